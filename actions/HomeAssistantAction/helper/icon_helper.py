@@ -35,6 +35,9 @@ def get_icon(state: Dict, settings: Settings) -> (str, float):
 
     icon = _get_icon_svg(name)
 
+    if state.get(const.HA_STALE):
+        icon = _add_stale_marker(icon)
+
     return (icon.replace("<color>", color).replace("<opacity>", str(opacity))), scale
 
 
@@ -154,3 +157,17 @@ def _get_icon_svg(name: str) -> str:
     return (f'<svg xmlns="http://www.w3.org/2000/svg" width="300" height="300" viewBox="0 0 24 '
             f'24"><title>{name}</title><path d="{path}" fill="<color>" opacity="<opacity>" '
             f'/></svg>')
+
+
+def _add_stale_marker(icon: str) -> str:
+    """
+    Add a small marker to the top right corner of an icon, showing that the state might be
+    outdated.
+    """
+    path = _get_icon_path(const.ICON_STALE)
+
+    if not icon or not path:
+        return icon
+
+    return icon.replace("</svg>", f'<g transform="translate(16 0) scale(0.33)"><path d="{path}" '
+                                  f'fill="{const.ICON_COLOR_ORANGE}" /></g></svg>')
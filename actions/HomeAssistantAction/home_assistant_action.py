@@ -5,12 +5,12 @@ The module for the Home Assistant action that is loaded in StreamController.
 import json
 from collections import Counter
 from json import JSONDecodeError
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 import gi
 gi.require_version("Adw", "1")
 from gi.repository.Gtk import Button, Align, Widget
-from gi.repository.Adw import PreferencesGroup
+from gi.repository.Adw import PreferencesGroup, EntryRow as AdwEntryRow
 
 from GtkHelper.GenerativeUI.ColorButtonRow import ColorButtonRow
 from GtkHelper.GenerativeUI.ComboRow import ComboRow
@@ -28,6 +28,7 @@ from de_gensyn_HomeAssistantPlugin.actions.HomeAssistantAction.customization.win
 from de_gensyn_HomeAssistantPlugin.actions.HomeAssistantAction.helper import icon_helper, text_helper
 from de_gensyn_HomeAssistantPlugin.actions.HomeAssistantAction.service_parameters import service_parameters_helper
 from de_gensyn_HomeAssistantPlugin.actions.HomeAssistantAction.settings.settings import Settings
+from de_gensyn_HomeAssistantPlugin.backend.service_call_result import ServiceCallResult
 from src.backend.PluginManager.ActionBase import ActionBase
 
 
@@ -41,6 +42,8 @@ class HomeAssistantAction(ActionBase):
         super().__init__(*args, **kwargs)
         self.initialized = False
         self.lm = self.plugin_base.locale_manager
+        # entity version, connection and stale state of what the key currently shows
+        self._rendered: Optional[Tuple[int, bool, bool]] = None
 
         self._init_entity_group()
         self._init_service_group()
@@ -53,19 +56,18 @@ class HomeAssistantAction(ActionBase):
         """
         Set up action when StreamController has finished loading.
         """
+        # loading the settings into the widgets must not register the entity for every widget
+        self.initialized = False
         self.settings = Settings(self)
 
         if not self.plugin_base.backend.is_connected():
             self.plugin_base.backend.register_action(self.on_ready)
 
-        entity = self.settings.get_entity()
-        if entity:
-            self.plugin_base.backend.add_tracked_entity(entity, self.settings.get_uuid(), self._entity_updated)
-
+        # service parameters and attributes are loaded from Home Assistant once the settings
+        # are opened
         self._load_domains()
         self._load_entities()
         self._load_services()
-        self._load_attributes()
         self._load_icon_settings()
         self._load_custom_icons()
         self._load_custom_text()
@@ -104,12 +106,27 @@ class HomeAssistantAction(ActionBase):
                 pass
             parameters[parameter] = value
 
-        self.plugin_base.backend.call_service(entity, service, parameters)
+        self.plugin_base.backend.call_service_async(
+            entity, service, parameters, callback=self._on_service_called
+        )
+
+    def _on_service_called(self, result: ServiceCallResult) -> None:
+        """
+        Executed when a service call has finished.
+        """
+        if not result.is_success():
+            self.show_error(duration=1)
 
     def get_config_rows(self) -> list:
         """
         Get the rows to be displayed in the UI.
         """
+        if self.initialized:
+            # the cache only holds the attributes the key needs - show all of them for selection
+            attributes = self.plugin_base.backend.get_entity_attributes(self.settings.get_entity())
+            service_parameters_helper.load_service_parameters(self, attributes)
+            self._load_attributes(attributes)
+            self._set_enabled_disabled()
         return [self._entity_group, self._service_group, self._icon_group, self._text_group]
 
     def _init_entity_group(self) -> None:
@@ -130,9 +147,15 @@ class HomeAssistantAction(ActionBase):
             complex_var_name=True
         )
 
+        # not a setting - the search only narrows down the entities to choose from
+        self.entity_search: AdwEntryRow = AdwEntryRow(
+            title=self.lm.get(const.LABEL_ENTITY_SEARCH)
+        )
+        self.entity_search.connect("changed", self._on_change_search)
+
         self._entity_group = self._create_group(
             const.LABEL_SETTINGS_ENTITY,
-            [self.entity_domain_combo.widget, self.entity_entity_combo.widget]
+            [self.entity_domain_combo.widget, self.entity_search, self.entity_entity_combo.widget]
         )
 
     def _init_service_group(self) -> None:
@@ -395,6 +418,7 @@ class HomeAssistantAction(ActionBase):
             self.settings.add_icon_customization(customization)
 
         self._load_custom_icons()
+        self._track_entity()
         self._entity_updated()
 
     def _load_text_settings(self) -> None:
@@ -441,12 +465,28 @@ class HomeAssistantAction(ActionBase):
             self.settings.add_text_customization(customization)
 
         self._load_custom_text()
+        self._track_entity()
         self._entity_updated()
 
     def _reload(self, *_):
+        if not self.initialized:
+            return
         self._set_enabled_disabled()
+        self._track_entity()
         self._entity_updated()
 
+    def _track_entity(self) -> None:
+        """
+        Register the entity with the backend, together with the attributes the current settings
+        need. Registering again updates the attributes.
+        """
+        entity = self.settings.get_entity()
+        if entity:
+            self.plugin_base.backend.add_tracked_entity(
+                entity, self.settings.get_uuid(), self._on_entity_update,
+                self.settings.get_required_attributes()
+            )
+
     def _on_change_domain(self, _, domain, old_domain):
         """
         Execute when the domain is changed.
@@ -471,7 +511,18 @@ class HomeAssistantAction(ActionBase):
         if domain:
             self._load_entities()
             self._load_services()
+            service_parameters_helper.load_service_parameters(self)
+
+        self._set_enabled_disabled()
+
+    def _on_change_search(self, _) -> None:
+        """
+        Execute when the entity search is changed.
+        """
+        if not self.initialized:
+            return
 
+        self._load_entities()
         self._set_enabled_disabled()
 
     def _on_change_entity(self, _, entity, old_entity):
@@ -491,10 +542,11 @@ class HomeAssistantAction(ActionBase):
             self.plugin_base.backend.remove_tracked_entity(old_entity, self.settings.get_uuid())
 
         if entity:
-            self.plugin_base.backend.add_tracked_entity(entity, self.settings.get_uuid(), self._entity_updated)
-            self._load_attributes()
-            service_parameters_helper.load_service_parameters(self)
+            attributes = self.plugin_base.backend.get_entity_attributes(entity)
+            self._load_attributes(attributes)
+            service_parameters_helper.load_service_parameters(self, attributes)
 
+        # registers the new entity
         self._reload()
 
     def _on_change_service(self, _, __, ___) -> None:
@@ -508,6 +560,17 @@ class HomeAssistantAction(ActionBase):
         service_parameters_helper.load_service_parameters(self)
         self._reload()
 
+    def _on_entity_update(self, state: dict = None) -> None:
+        """
+        Executed by the backend when the entity or the connection changed. The key is not redrawn
+        if it already shows this version of the entity with the same connection state.
+        """
+        if state is None:
+            state = self.plugin_base.backend.get_entity(self.settings.get_entity())
+        if _get_render_state(state) == self._rendered:
+            return
+        self._entity_updated(state)
+
     def _entity_updated(self, state: dict = None) -> None:
         """
         Executed when an entity is updated to reflect the changes on the key.
@@ -515,13 +578,11 @@ class HomeAssistantAction(ActionBase):
         if not self.initialized:
             return
 
-        # different entities have different attributes -> reload
-        self._load_attributes()
-
         show_icon = self.settings.get_show_icon()
         show_text = self.settings.get_show_text()
 
         if not show_icon and not show_text:
+            self._rendered = None
             self.set_media()
             self._clear_labels()
             return
@@ -530,6 +591,7 @@ class HomeAssistantAction(ActionBase):
         if (show_icon or show_text) and state is None:
             state = self.plugin_base.backend.get_entity(entity)
 
+        self._rendered = _get_render_state(state)
         self._update_icon(show_icon, state)
         self._update_labels(show_text, state)
 
@@ -575,21 +637,23 @@ class HomeAssistantAction(ActionBase):
         Load domains from Home Assistant.
         """
         domain = self.settings.get_domain()
-        domains = sorted(self.plugin_base.backend.get_domains())
+        domains = self.plugin_base.backend.get_domains()
         if domain not in domains:
             domains.append(domain)
         self.entity_domain_combo.populate(domains, domain, trigger_callback=False)
 
     def _load_entities(self) -> None:
         """
-        Load entities from Home Assistant.
+        Load entities from Home Assistant. While a search is entered, only the matching entities
+        are loaded, best matches first.
         """
         entity = self.settings.get_entity()
-        entities = sorted(
-            self.plugin_base.backend.get_entities(
-                str(self.entity_domain_combo.get_selected_item())
-            )
-        )
+        domain = str(self.entity_domain_combo.get_selected_item())
+        query = self.entity_search.get_text().strip()
+        if query:
+            entities = self.plugin_base.backend.search_entities(query, domain)
+        else:
+            entities = self.plugin_base.backend.get_entities(domain)
         if entity not in entities:
             entities.append(entity)
         self.entity_entity_combo.populate(entities, entity, trigger_callback=False)
@@ -603,16 +667,14 @@ class HomeAssistantAction(ActionBase):
             str(self.entity_domain_combo.get_selected_item())
         )
         self.service_service_combo.populate(services, service, update_settings=True, trigger_callback=False)
-        service_parameters_helper.load_service_parameters(self)
 
-    def _load_attributes(self) -> None:
+    def _load_attributes(self, attributes: dict) -> None:
         """
-        Load entity attributes from Home Assistant.
+        Load the entity attributes fetched from Home Assistant into the text attribute selection.
         """
         attribute = self.settings.get_text_attribute()
-        ha_entity = self.plugin_base.backend.get_entity(self.settings.get_entity())
         attribute_model = [const.STATE]
-        attribute_model.extend(list(ha_entity.get(const.ATTRIBUTES, {}).keys()))
+        attribute_model.extend(list(attributes.keys()))
         if attribute not in attribute_model:
             attribute_model.append(attribute)
         if Counter(attribute_model) != Counter(self._get_current_attributes()):
@@ -700,6 +762,7 @@ class HomeAssistantAction(ActionBase):
 
         self._load_custom_icons()
         self._load_custom_text()
+        self._track_entity()
         self._entity_updated()
 
     def _on_move_up(self, _, customization_type: str, index: int):
@@ -732,6 +795,7 @@ class HomeAssistantAction(ActionBase):
         # Entity section
         domain = self.settings.get_domain()
         is_domain_set = bool(domain)
+        self.entity_search.set_sensitive(is_domain_set)
         self.entity_entity_combo.set_sensitive(
             is_domain_set and self.entity_entity_combo.get_item_amount() > 1
         )
@@ -818,4 +882,12 @@ class HomeAssistantAction(ActionBase):
         return [
             str(self.text_attribute_combo.get_item_at(i))
             for i in range(self.text_attribute_combo.get_item_amount())
-        ]
\ No newline at end of file
+        ]
+
+
+def _get_render_state(state: dict) -> Tuple[int, bool, bool]:
+    """
+    Get what decides whether a key must be redrawn: the entity version and the connection state.
+    """
+    return (state.get(const.VERSION, 0), state.get(const.HA_CONNECTED, False),
+            state.get(const.HA_STALE, False))
@@ -1,6 +1,8 @@
 """
 Module for service parameter operations.
 """
+from typing import Any, Dict, Optional
+
 from de_gensyn_HomeAssistantPlugin import const
 from de_gensyn_HomeAssistantPlugin.actions.HomeAssistantAction.service_parameters.parameter_combo_row import \
     ParameterComboRow
@@ -12,19 +14,21 @@ from de_gensyn_HomeAssistantPlugin.actions.HomeAssistantAction.service_parameter
     ParameterSwitchRow
 
 
-def load_service_parameters(action):
+def load_service_parameters(action, attributes: Optional[Dict[str, Any]] = None):
     """
-    Load service parameters from Home Assistant.
+    Load service parameters from Home Assistant. Pass the attributes of the entity if they have
+    already been fetched; otherwise they are fetched, which is a round trip to Home Assistant.
     """
     action.service_parameters.clear_rows()
 
-    ha_entity = action.plugin_base.backend.get_entity(action.settings.get_entity())
-
     service = action.settings.get_service()
 
-    if not ha_entity or not service:
+    if not service:
         return
 
+    if attributes is None:
+        attributes = action.plugin_base.backend.get_entity_attributes(action.settings.get_entity())
+
     fields = action.plugin_base.backend.get_services(
         str(action.entity_domain_combo.get_selected_item())).get(
         service, {}).get(const.ATTRIBUTE_FIELDS, {})
@@ -41,12 +45,11 @@ def load_service_parameters(action):
         selector = list(fields[field]["selector"].keys())[0]
 
         var_name = f"{const.SETTING_SERVICE}.{const.SETTING_PARAMETERS}.{field}"
-        if selector == "select" or f"{field}_list" in ha_entity.get(const.ATTRIBUTES,
-                                                                    {}).keys():
+        if selector == "select" or f"{field}_list" in attributes.keys():
             if selector == "select":
                 options = fields[field]["selector"]["select"]["options"]
             else:
-                options = ha_entity.get(const.ATTRIBUTES, {})[f"{field}_list"]
+                options = attributes[f"{field}_list"]
 
             if not isinstance(options[0], str):
                 options = [opt["value"] for opt in options]
@@ -3,7 +3,7 @@ Module to manage HomeAssistantPlugin action settings.
 """
 
 import copy
-from typing import Dict, Any, Tuple, List
+from typing import Dict, Any, Tuple, List, Set
 
 from de_gensyn_HomeAssistantPlugin import const
 from de_gensyn_HomeAssistantPlugin.actions.HomeAssistantAction.customization.icon_customization import IconCustomization
@@ -331,6 +331,27 @@ class Settings:
         self.settings[const.SETTING_TEXT][const.SETTING_CUSTOMIZATIONS].append(customization.export())
         self.action.set_settings(self.settings)
 
+    def get_required_attributes(self) -> Set[str]:
+        """
+        Get the entity attributes needed to show the entity: the icon, the unit of measurement,
+        the text attribute and the attributes referenced by the customizations.
+        :return: the names of the needed attributes
+        """
+        attributes = {
+            const.ATTRIBUTE_ICON, const.ATTRIBUTE_UNIT_OF_MEASUREMENT, self.get_text_attribute()
+        }
+
+        for customization in self.get_icon_customizations():
+            attributes.add(customization.get_attribute())
+
+        for customization in self.get_text_customizations():
+            attributes.add(customization.get_attribute())
+            if customization.get_text_attribute() is not None:
+                attributes.add(customization.get_text_attribute())
+
+        attributes.difference_update((const.STATE, const.CUSTOM_TEXT_TEXT_LENGTH))
+        return attributes
+
     def reset(self, domain: str) -> None:
         """
         Delete the settings and keeps only the UUID. The given domain if also set.
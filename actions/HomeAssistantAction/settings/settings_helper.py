@@ -43,7 +43,13 @@ DEFAULT_CONNECTION = {
     const.SETTING_PORT: const.EMPTY_STRING,
     const.SETTING_SSL: True,
     const.SETTING_VERIFY_CERTIFICATE: True,
-    const.SETTING_TOKEN: const.EMPTY_STRING
+    const.SETTING_TOKEN: const.EMPTY_STRING,
+    const.SETTING_SINGLE_SOCKET: False,
+    const.SETTING_COMPRESSION: True,
+    const.SETTING_MAX_UPDATE_RATE: const.DEFAULT_MAX_UPDATE_RATE,
+    const.SETTING_MAX_MISSED_PONGS: const.DEFAULT_MAX_MISSED_PONGS,
+    const.SETTING_OFFLINE_GRACE_PERIOD: const.DEFAULT_OFFLINE_GRACE_PERIOD,
+    const.SETTING_SHOW_STALE: const.DEFAULT_SHOW_STALE
 }
 
 DEFAULT_ACTION = {
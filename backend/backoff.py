@@ -0,0 +1,38 @@
+"""
+Module to calculate the delays between connection attempts.
+"""
+
+import random
+
+
+class Backoff:
+    """
+    Exponential backoff with jitter. Every delay is the previous one multiplied by the factor, up to
+    the maximum. The jitter spreads the delays randomly, so several clients that lost the connection
+    at the same time don't all reconnect in lockstep.
+    :param initial_delay: the first delay in seconds
+    :param max_delay: the longest delay in seconds
+    :param factor: the factor by which the delay grows with every attempt
+    :param jitter: the fraction by which a delay is randomly shortened or lengthened
+    """
+
+    def __init__(self, initial_delay: float, max_delay: float, factor: float, jitter: float):
+        self._initial_delay: float = initial_delay
+        self._max_delay: float = max_delay
+        self._factor: float = factor
+        self._jitter: float = jitter
+        self._attempt: int = 0
+
+    def next_delay(self) -> float:
+        """
+        Get the delay before the next attempt.
+        :return: the delay in seconds
+        """
+        delay = min(self._initial_delay * self._factor ** self._attempt, self._max_delay)
+        if delay < self._max_delay:
+            self._attempt += 1
+        return delay * random.uniform(1 - self._jitter, 1 + self._jitter)
+
+    def reset(self) -> None:
+        """Start over with the initial delay, e.g. because the connection was established."""
+        self._attempt = 0
@@ -0,0 +1,119 @@
+"""
+Module to execute action callbacks outside the event loop.
+"""
+
+from collections import deque
+from threading import Condition, Thread
+from typing import Any, Callable, Deque, Dict, List
+
+from loguru import logger as log
+
+from de_gensyn_HomeAssistantPlugin import const
+
+
+class CallbackDispatcher:
+    """
+    Executes action callbacks one after another on a dedicated worker thread, so the event loop
+    never waits for a slow callback and can always drain the sockets. No callback is ever dropped;
+    instead, an entity update for a key replaces the update still waiting for the same key, so the
+    queue holds at most one update per key.
+    :param name: the name of the worker thread
+    """
+
+    def __init__(self, name: str):
+        # entries are [key, callback, args]; key is None for callbacks that are not updates
+        self._queue: Deque[List[Any]] = deque()
+        self._updates: Dict[str, List[Any]] = {}
+        self._condition = Condition()
+        self._max_depth: int = 0
+        self._dispatched: int = 0
+        self._coalesced: int = 0
+        self._worker = Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, callback: Callable, *args) -> None:
+        """
+        Queue a callback for execution. Never blocks.
+        :param callback: the callback to execute
+        :param args: the arguments for the callback
+        """
+        self._enqueue([None, callback, args])
+
+    def submit_update(self, key: str, callback: Callable, update_state: Dict[str, Any]) -> None:
+        """
+        Queue an entity update for a key. If an update for the key is still waiting, it is
+        replaced, keeping the fields changed by both. Never blocks.
+        :param key: the uid of the key
+        :param callback: the callback of the key
+        :param update_state: the update to deliver
+        """
+        with self._condition:
+            queued = self._updates.get(key)
+            if queued:
+                update_state = dict(update_state)
+                update_state[const.CHANGED_FIELDS] = (
+                    queued[2][0][const.CHANGED_FIELDS] | update_state[const.CHANGED_FIELDS]
+                )
+                queued[1] = callback
+                queued[2] = (update_state,)
+                self._coalesced += 1
+            else:
+                # the condition's lock is reentrant
+                self._enqueue([key, callback, (update_state,)])
+
+    def _enqueue(self, entry: List[Any]) -> None:
+        """Append an entry to the queue and wake up the worker."""
+        with self._condition:
+            if entry[0] is not None:
+                self._updates[entry[0]] = entry
+            self._queue.append(entry)
+            self._max_depth = max(self._max_depth, len(self._queue))
+            self._condition.notify()
+
+    def get_depth(self) -> int:
+        """
+        Get the number of callbacks waiting for execution.
+        :return: the number of callbacks waiting for execution
+        """
+        return len(self._queue)
+
+    def get_max_depth(self) -> int:
+        """
+        Get the highest number of callbacks that were waiting for execution at the same time.
+        :return: the highest queue depth
+        """
+        return self._max_depth
+
+    def get_dispatched_count(self) -> int:
+        """
+        Get the number of callbacks executed so far.
+        :return: the number of callbacks executed so far
+        """
+        return self._dispatched
+
+    def get_coalesced_count(self) -> int:
+        """
+        Get the number of updates that replaced an update still waiting for the same key.
+        :return: the number of coalesced updates
+        """
+        return self._coalesced
+
+    def _run(self) -> None:
+        """Execute queued callbacks until the process ends."""
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                key, callback, args = self._queue.popleft()
+                if key is not None:
+                    del self._updates[key]
+            _run_callback(callback, *args)
+            self._dispatched += 1
+
+
+def _run_callback(callback: Callable, *args) -> None:
+    """Execute an action callback and log any exception it raises."""
+    try:
+        callback(*args)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        log.exception(f"Error in action callback {callback}: {e}")
@@ -0,0 +1,83 @@
+"""
+Module for the JSON codecs used to encode and decode websocket messages.
+"""
+
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Codec(ABC):
+    """
+    Base class for a codec that converts between websocket frames and Python objects.
+    """
+
+    @abstractmethod
+    def get_name(self) -> str:
+        """
+        Get the name of the codec.
+        :return: the name of the codec
+        """
+
+    @abstractmethod
+    def loads(self, frame: Union[str, bytes]) -> Any:
+        """
+        Decode a websocket frame.
+        :param frame: the frame to decode
+        :return: the decoded object
+        :raises ValueError: if the frame is not valid JSON
+        """
+
+    @abstractmethod
+    def dumps(self, message: Any) -> str:
+        """
+        Encode a message as a text frame.
+        :param message: the message to encode
+        :return: the encoded message
+        """
+
+
+class JsonCodec(Codec):
+    """
+    Codec based on the json module of the standard library.
+    """
+
+    def get_name(self) -> str:
+        return "json"
+
+    def loads(self, frame: Union[str, bytes]) -> Any:
+        return json.loads(frame)
+
+    def dumps(self, message: Any) -> str:
+        return json.dumps(message)
+
+
+class OrjsonCodec(Codec):
+    """
+    Codec based on orjson, which decodes large messages considerably faster.
+    """
+
+    def get_name(self) -> str:
+        return "orjson"
+
+    def loads(self, frame: Union[str, bytes]) -> Any:
+        return orjson.loads(frame)  # pylint: disable=no-member
+
+    def dumps(self, message: Any) -> str:
+        # Home Assistant only accepts text frames
+        return orjson.dumps(message).decode("utf-8")  # pylint: disable=no-member
+
+
+def get_default_codec() -> Codec:
+    """
+    Get the fastest codec that is available.
+    :return: the orjson codec if orjson is installed, the json codec otherwise
+    """
+    if orjson is not None:
+        return OrjsonCodec()
+    return JsonCodec()
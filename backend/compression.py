@@ -0,0 +1,95 @@
+"""
+Module for the permessage-deflate compression of the websocket connections.
+"""
+
+from typing import Optional, Sequence
+
+from websockets.extensions.base import Extension
+from websockets.extensions.permessage_deflate import ClientPerMessageDeflateFactory
+from websockets.frames import CTRL_OPCODES, Frame
+from websockets.typing import ExtensionParameter
+
+
+class TransferCounter:
+    """
+    Counts the bytes transferred on the wire and the bytes of the messages they contain.
+    """
+
+    def __init__(self):
+        self.wire_bytes_received: int = 0
+        self.raw_bytes_received: int = 0
+        self.wire_bytes_sent: int = 0
+        self.raw_bytes_sent: int = 0
+
+    def add_received(self, wire_bytes: int, raw_bytes: int) -> None:
+        """
+        Count a received frame.
+        :param wire_bytes: the size of the frame payload as received
+        :param raw_bytes: the size of the frame payload after decompression
+        """
+        self.wire_bytes_received += wire_bytes
+        self.raw_bytes_received += raw_bytes
+
+    def add_sent(self, wire_bytes: int, raw_bytes: int) -> None:
+        """
+        Count a sent frame.
+        :param wire_bytes: the size of the frame payload as sent
+        :param raw_bytes: the size of the frame payload before compression
+        """
+        self.wire_bytes_sent += wire_bytes
+        self.raw_bytes_sent += raw_bytes
+
+    def get_stats(self) -> dict:
+        """
+        Get the counted bytes.
+        :return: the wire and raw bytes received and sent
+        """
+        return {
+            "wire_bytes_received": self.wire_bytes_received,
+            "raw_bytes_received": self.raw_bytes_received,
+            "wire_bytes_sent": self.wire_bytes_sent,
+            "raw_bytes_sent": self.raw_bytes_sent,
+        }
+
+
+class CountingExtension(Extension):
+    """
+    Wraps a negotiated extension and counts the payload sizes before and after it.
+    :param extension: the negotiated extension
+    :param counter: the counter to add the payload sizes to
+    """
+
+    def __init__(self, extension: Extension, counter: TransferCounter):
+        self.name = extension.name
+        self._extension = extension
+        self._counter = counter
+
+    def decode(self, frame: Frame, *, max_size: Optional[int] = None) -> Frame:
+        decoded = self._extension.decode(frame, max_size=max_size)
+        if frame.opcode not in CTRL_OPCODES:
+            self._counter.add_received(len(frame.data), len(decoded.data))
+        return decoded
+
+    def encode(self, frame: Frame) -> Frame:
+        encoded = self._extension.encode(frame)
+        if frame.opcode not in CTRL_OPCODES:
+            self._counter.add_sent(len(encoded.data), len(frame.data))
+        return encoded
+
+
+class CountingPerMessageDeflateFactory(ClientPerMessageDeflateFactory):
+    """
+    Offers permessage-deflate with the default settings of the websockets library and counts the
+    transferred bytes of every connection that negotiated it.
+    :param counter: the counter to add the payload sizes to
+    """
+
+    def __init__(self, counter: TransferCounter):
+        super().__init__(compress_settings={"memLevel": 5})
+        self._counter = counter
+
+    def process_response_params(
+        self, params: Sequence[ExtensionParameter], accepted_extensions: Sequence[Extension]
+    ) -> Extension:
+        extension = super().process_response_params(params, accepted_extensions)
+        return CountingExtension(extension, self._counter)
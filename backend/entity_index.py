@@ -0,0 +1,143 @@
+"""
+Module for the sorted and searchable index of all domains and entities.
+"""
+
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional
+
+from de_gensyn_HomeAssistantPlugin.backend.entity_store import EntityRecord
+
+FRIENDLY_NAME = "friendly_name"
+
+
+class EntityIndex:
+    """
+    Keeps the domains and entities of Home Assistant in sorted order and allows searching the
+    entities by id and friendly name. The index is updated incrementally, so neither listing nor
+    searching ever needs to sort all entities again.
+    """
+
+    def __init__(self):
+        self._domains: List[str] = []
+        self._entities: Dict[str, List[str]] = {}
+        self._entity_ids: List[str] = []
+        self._names: Dict[str, str] = {}
+
+    def rebuild(self, entities: Dict[str, Dict[str, EntityRecord]]) -> None:
+        """
+        Replace the index with the entities of the entity cache.
+        :param entities: the entity cache by domain and entity id
+        """
+        self._domains = sorted(entities.keys())
+        self._entities = {domain: sorted(domain_entities.keys())
+                          for domain, domain_entities in entities.items()}
+        self._entity_ids = sorted(entity_id for domain_entities in entities.values()
+                                  for entity_id in domain_entities)
+        self._names = {
+            entity_id: _get_name(entity)
+            for domain_entities in entities.values()
+            for entity_id, entity in domain_entities.items()
+        }
+
+    def add(self, entity_id: str, entity: Optional[EntityRecord] = None) -> None:
+        """
+        Add an entity to the index.
+        :param entity_id: the id of the entity
+        :param entity: the cached entity, if already known
+        """
+        domain = entity_id.split(".")[0]
+        if domain not in self._entities:
+            insort(self._domains, domain)
+            self._entities[domain] = []
+        if entity_id not in self._names:
+            insort(self._entities[domain], entity_id)
+            insort(self._entity_ids, entity_id)
+        self._names[entity_id] = _get_name(entity)
+
+    def remove(self, entity_id: str) -> None:
+        """
+        Remove an entity from the index; its domain is removed with its last entity.
+        :param entity_id: the id of the entity
+        """
+        if self._names.pop(entity_id, None) is None:
+            return
+        domain = entity_id.split(".")[0]
+        _remove_sorted(self._entities[domain], entity_id)
+        _remove_sorted(self._entity_ids, entity_id)
+        if not self._entities[domain]:
+            del self._entities[domain]
+            _remove_sorted(self._domains, domain)
+
+    def update_name(self, entity_id: str, entity: EntityRecord) -> None:
+        """
+        Update the friendly name of an entity in the search index.
+        :param entity_id: the id of the entity
+        :param entity: the cached entity
+        """
+        if entity_id in self._names:
+            self._names[entity_id] = _get_name(entity)
+
+    def get_domains(self) -> List[str]:
+        """
+        Get all domains in sorted order.
+        :return: a copy of the sorted domains
+        """
+        return list(self._domains)
+
+    def get_entities(self, domain: str) -> List[str]:
+        """
+        Get all entities of a domain in sorted order.
+        :param domain: the domain
+        :return: a copy of the sorted entity ids
+        """
+        return list(self._entities.get(domain, []))
+
+    def search(self, query: str, domain: Optional[str] = None, limit: int = 50) -> List[str]:
+        """
+        Search entities by id and friendly name. Entities whose id, object id or one of the words of
+        their friendly name start with the query come first, followed by entities that contain all
+        characters of the query in order (fuzzy matches).
+        :param query: the text to search for
+        :param domain: only search the entities of this domain
+        :param limit: the maximum number of results
+        :return: the matching entity ids, best matches first
+        """
+        query = query.strip().lower()
+        candidates = self._entities.get(domain, []) if domain else self._entity_ids
+        if not query:
+            return candidates[:limit]
+
+        prefix_matches = []
+        fuzzy_matches = []
+        for entity_id in candidates:
+            name = self._names.get(entity_id, "")
+            object_id = entity_id.split(".", 1)[-1]
+            if (entity_id.startswith(query) or object_id.startswith(query)
+                    or any(word.startswith(query) for word in name.split())):
+                prefix_matches.append(entity_id)
+            elif _is_subsequence(query, object_id) or _is_subsequence(query, name):
+                fuzzy_matches.append(entity_id)
+            if len(prefix_matches) >= limit:
+                break
+
+        return (prefix_matches + fuzzy_matches)[:limit]
+
+
+def _get_name(entity: Optional[EntityRecord]) -> str:
+    """Get the lowercase friendly name of a cached entity."""
+    if not entity:
+        return ""
+    return str(entity.attributes.get(FRIENDLY_NAME, "")).lower()
+
+
+def _remove_sorted(items: List[str], item: str) -> None:
+    """Remove an item from a sorted list."""
+    index = bisect_left(items, item)
+    if index < len(items) and items[index] == item:
+        del items[index]
+
+
+def _is_subsequence(query: str, text: str) -> bool:
+    """Return whether all characters of the query appear in the text in the same order."""
+    characters = iter(text)
+    return all(character in characters for character in query)
@@ -0,0 +1,187 @@
+"""
+Module for the compact in-memory representation of the entity cache.
+"""
+
+import sys
+from typing import Any, Dict, Optional, Set, Tuple
+
+MAX_POOL_SIZE = 10000
+
+
+class EntityRecord:
+    """
+    A cached entity. Slotted to keep the per-entity overhead small, as the cache holds every
+    entity known to Home Assistant. Records are never changed once published - every change
+    publishes a new record - so they can be read from any thread.
+    :param state: the state of the entity
+    :param attributes: the attributes of the entity; values may be shared with other entities
+    and must be treated as read-only
+    :param version: the store version the record was published with
+    """
+    __slots__ = ("state", "attributes", "version")
+
+    def __init__(self, state: Any, attributes: Dict[str, Any], version: int):
+        self.state: Any = state
+        self.attributes: Dict[str, Any] = attributes
+        self.version: int = version
+
+
+class EntityStore:
+    """
+    The versioned entity cache. Only the event loop writes to it. Each change publishes a new
+    record with a higher version, so readers on other threads need no lock, always see
+    consistent entities and can tell whether an entity has changed since a version they have
+    seen.
+    """
+
+    def __init__(self):
+        self._entities: Dict[str, Dict[str, EntityRecord]] = {}
+        self._version: int = 0
+
+    def get(self, entity_id: str) -> Optional[EntityRecord]:
+        """
+        Get the current record of an entity.
+        :param entity_id: the id of the entity
+        :return: the record or None if the entity is unknown
+        """
+        return self._entities.get(entity_id.split(".")[0], {}).get(entity_id)
+
+    def get_all(self) -> Dict[str, Dict[str, EntityRecord]]:
+        """
+        Get all records by domain and entity id. Only iterate them on the event loop.
+        :return: all records
+        """
+        return self._entities
+
+    def is_empty(self) -> bool:
+        """
+        Get whether no entities are cached.
+        :return: whether no entities are cached
+        """
+        return not self._entities
+
+    def publish(self, entity_id: str, state: Any, attributes: Dict[str, Any]) -> EntityRecord:
+        """
+        Publish a new state of an entity.
+        :param entity_id: the id of the entity
+        :param state: the new state
+        :param attributes: the new attributes; must not be changed afterwards
+        :return: the new record
+        """
+        self._version += 1
+        record = EntityRecord(state, attributes, self._version)
+        self._entities.setdefault(entity_id.split(".")[0], {})[entity_id] = record
+        return record
+
+    def publish_all(self, states: Dict[str, Tuple[Any, Dict[str, Any]]]) -> None:
+        """
+        Replace all entities at once.
+        :param states: the state and attributes by entity id; the attributes must not be changed
+        afterwards
+        """
+        self._version += 1
+        entities = {}
+        for entity_id, (state, attributes) in states.items():
+            entities.setdefault(entity_id.split(".")[0], {})[entity_id] = EntityRecord(
+                state, attributes, self._version
+            )
+        self._entities = entities
+
+    def remove(self, entity_id: str) -> Optional[EntityRecord]:
+        """
+        Remove an entity.
+        :param entity_id: the id of the entity
+        :return: the last record of the entity or None if it was unknown
+        """
+        domain = entity_id.split(".")[0]
+        record = self._entities.get(domain, {}).pop(entity_id, None)
+        if record is None:
+            return None
+
+        self._version += 1
+        if not self._entities[domain]:
+            self._entities.pop(domain)
+        return record
+
+
+class ValuePool:
+    """
+    Makes equal values share one object. Strings, including all attribute names, are interned;
+    lists of plain values, e.g. the supported modes of hundreds of lights, are pooled. Shared
+    values are never modified - changes always replace them.
+    :param max_size: the number of pooled lists after which the pool starts over, so values
+    that are no longer used don't accumulate forever
+    """
+
+    def __init__(self, max_size: int = MAX_POOL_SIZE):
+        self._lists: Dict[tuple, list] = {}
+        self._max_size: int = max_size
+
+    def share(self, value: Any) -> Any:
+        """
+        Get the shared object for a value.
+        :param value: the value
+        :return: an equal value that may be shared
+        """
+        if isinstance(value, str):
+            return sys.intern(value)
+        if isinstance(value, dict):
+            return self.share_attributes(value)
+        if not isinstance(value, list):
+            return value
+
+        value = [self.share(item) for item in value]
+        # include the types, so e.g. [1] and [True] don't share one list
+        key = tuple((type(item), item) for item in value)
+        try:
+            shared = self._lists.get(key)
+        except TypeError:
+            # contains unhashable items like nested lists or dicts
+            return value
+        if shared is None:
+            if len(self._lists) >= self._max_size:
+                self._lists = {}
+            self._lists[key] = value
+            shared = value
+        return shared
+
+    def share_attributes(self, attributes: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Get a copy of attributes with shared names and values.
+        :param attributes: the attributes
+        :return: the attributes with shared names and values
+        """
+        return {
+            sys.intern(name) if isinstance(name, str) else name: self.share(value)
+            for name, value in attributes.items()
+        }
+
+    def get_size(self) -> int:
+        """
+        Get the number of pooled lists.
+        :return: the number of pooled lists
+        """
+        return len(self._lists)
+
+
+def get_deep_size(value: Any, seen: Set[int]) -> int:
+    """
+    Estimate the memory used by a value and everything it references. Objects in seen are not
+    counted again, so shared values are only counted once.
+    :param value: the value
+    :param seen: the ids of the objects that have already been counted
+    :return: the estimated size in bytes
+    """
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(get_deep_size(key, seen) + get_deep_size(item, seen)
+                    for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(get_deep_size(item, seen) for item in value)
+    elif isinstance(value, EntityRecord):
+        size += get_deep_size(value.state, seen) + get_deep_size(value.attributes, seen)
+    return size
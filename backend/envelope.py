@@ -0,0 +1,120 @@
+"""
+Module for messages received from Home Assistant.
+"""
+
+from typing import Any, Dict, List, Optional, Union
+
+from loguru import logger as log
+
+from de_gensyn_HomeAssistantPlugin.backend.codec import Codec
+
+ID = "id"
+FIELD_TYPE = "type"
+FIELD_SUCCESS = "success"
+FIELD_RESULT = "result"
+FIELD_ERROR = "error"
+FIELD_EVENT = "event"
+FIELD_MESSAGE = "message"
+
+
+class Envelope:
+    """
+    A message received from Home Assistant. Every frame is decoded exactly once into an
+    envelope, which is then shared by all consumers of the message.
+    :param message: the decoded message
+    """
+    __slots__ = ("message",)
+
+    def __init__(self, message: Dict[str, Any]):
+        self.message: Dict[str, Any] = message
+
+    def get_id(self) -> Optional[int]:
+        """
+        Get the message id, which is the id of the request or subscription the message belongs to.
+        :return: the message id
+        """
+        return self.message.get(ID)
+
+    def get_type(self) -> str:
+        """
+        Get the message type.
+        :return: the message type
+        """
+        return self.message.get(FIELD_TYPE, "")
+
+    def is_success(self) -> bool:
+        """
+        Get whether the request this message responds to was successful.
+        :return: whether the request was successful
+        """
+        return bool(self.message.get(FIELD_SUCCESS, False))
+
+    def get_result(self) -> Any:
+        """
+        Get the result of the request this message responds to.
+        :return: the result
+        """
+        return self.message.get(FIELD_RESULT)
+
+    def get_error(self) -> Optional[str]:
+        """
+        Get the error message if the request this message responds to failed.
+        :return: the error message or None
+        """
+        error = self.message.get(FIELD_ERROR)
+        if isinstance(error, dict):
+            return error.get(FIELD_MESSAGE)
+        return error
+
+    def get_event(self) -> Dict[str, Any]:
+        """
+        Get the event data of an event message.
+        :return: the event data
+        """
+        return self.message.get(FIELD_EVENT) or {}
+
+
+def decode(frame: Union[str, bytes], codec: Codec) -> Optional[Envelope]:
+    """
+    Decode a websocket frame into an envelope.
+    :param frame: the frame to decode
+    :param codec: the codec to decode the frame with
+    :return: the envelope or None if the frame is not a valid message
+    """
+    try:
+        message = codec.loads(frame)
+    except ValueError:
+        log.error(f"Could not parse {frame}")
+        return None
+
+    if not isinstance(message, dict):
+        log.error(f"Unexpected message {frame}")
+        return None
+
+    return Envelope(message)
+
+
+def decode_batch(frame: Union[str, bytes], codec: Codec) -> List[Envelope]:
+    """
+    Decode a websocket frame that contains either a single message or, once coalescing has been
+    negotiated with Home Assistant, an array of messages.
+    :param frame: the frame to decode
+    :param codec: the codec to decode the frame with
+    :return: the envelopes of all valid messages in the frame
+    """
+    try:
+        messages = codec.loads(frame)
+    except ValueError:
+        log.error(f"Could not parse {frame}")
+        return []
+
+    if not isinstance(messages, list):
+        messages = [messages]
+
+    envelopes = []
+    for message in messages:
+        if isinstance(message, dict):
+            envelopes.append(Envelope(message))
+        else:
+            log.error(f"Unexpected message {message}")
+    return envelopes
@@ -1,69 +1,163 @@
 """
 Module for the Home Assistant backend.
 """
+# pylint: disable=too-many-lines
 
-import json
-from threading import Thread, Semaphore
-from time import sleep
-from ssl import CERT_NONE, SSLError, SSLEOFError
-from typing import Dict, Callable, Any, List, Set, Optional
+import asyncio
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from ssl import CERT_NONE, SSLError, create_default_context
+from threading import Thread, current_thread
+from time import monotonic
+from typing import Dict, Callable, Any, List, Set, Optional, Coroutine, FrozenSet, Iterable
 
 from loguru import logger as log
-from websocket import (
-    create_connection,
-    WebSocket,
-    WebSocketException,
-    WebSocketAddressException,
-)
+from websockets.asyncio.client import connect, ClientConnection
+from websockets.exceptions import WebSocketException, InvalidURI
+from websockets.protocol import State
 
 from de_gensyn_HomeAssistantPlugin import const
+from de_gensyn_HomeAssistantPlugin.backend import state_delta
+from de_gensyn_HomeAssistantPlugin.backend.backoff import Backoff
+from de_gensyn_HomeAssistantPlugin.backend.callback_dispatcher import CallbackDispatcher
+from de_gensyn_HomeAssistantPlugin.backend.codec import get_default_codec
+from de_gensyn_HomeAssistantPlugin.backend.compression import CountingPerMessageDeflateFactory, \
+    TransferCounter
+from de_gensyn_HomeAssistantPlugin.backend.entity_index import EntityIndex, FRIENDLY_NAME
+from de_gensyn_HomeAssistantPlugin.backend.entity_store import EntityRecord, EntityStore, \
+    ValuePool, get_deep_size
+from de_gensyn_HomeAssistantPlugin.backend.envelope import Envelope, decode, decode_batch, ID, \
+    FIELD_TYPE
+from de_gensyn_HomeAssistantPlugin.backend.latency_histogram import LatencyHistogram
+from de_gensyn_HomeAssistantPlugin.backend.request_correlator import RequestCorrelator
+from de_gensyn_HomeAssistantPlugin.backend.service_call_result import ServiceCallResult
+from de_gensyn_HomeAssistantPlugin.backend.snapshot import create_snapshot, load_snapshot, \
+    save_snapshot, FIELD_ENTITIES, FIELD_SERVICES
+from de_gensyn_HomeAssistantPlugin.backend.subscription_registry import SubscriptionRegistry
+from de_gensyn_HomeAssistantPlugin.backend.update_coalescer import UpdateCoalescer
 
 HASS_WEBSOCKET_API = "/api/websocket?latest"
 
-FIELD_EVENT = "event"
 ENTITY_ID = "entity_id"
-ID = "id"
-FIELD_TYPE = "type"
-FIELD_SUCCESS = "success"
-FIELD_RESULT = "result"
+TYPE_EVENT = "event"
+TYPE_RESULT = "result"
+TYPE_PONG = "pong"
+FIELD_DATA = "data"
+FIELD_DOMAIN = "domain"
+FIELD_SERVICE = "service"
+EVENT_SERVICE_REGISTERED = "service_registered"
+EVENT_SERVICE_REMOVED = "service_removed"
+EVENT_ENTITY_REGISTRY_UPDATED = "entity_registry_updated"
+REGISTRY_ACTION_CREATE = "create"
+REGISTRY_ACTION_REMOVE = "remove"
+REGISTRY_ACTION_UPDATE = "update"
 BUTTON_ENCODE_SYMBOL = "-"
-RECV_LOOP_TIMEOUT = 300
-PING_INTERVAL = 30
+PING_INTERVAL = 5
+RTT_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5]
+RTT_WINDOW = 120
+SUBSCRIPTION_UPDATE_DELAY = 0.1
+ENTITY_FETCH_DELAY = 1
+RETRY_INITIAL_DELAY = 1
+RETRY_MAX_DELAY = 300
+RETRY_BACKOFF_FACTOR = 2
+RETRY_JITTER = 0.2
+PROBE_INTERVAL = 2
+OPEN_TIMEOUT = 10
+# a connection found dead must not delay reconnecting by waiting for its closing handshake
+CLOSE_TIMEOUT = 1
+REQUEST_TIMEOUT = 10
+COMMAND_TIMEOUT = 2 * OPEN_TIMEOUT + REQUEST_TIMEOUT
+SNAPSHOT_DELAY = 60
+# attributes kept for all entities, whether a key needs them or not; needed to search entities
+KEPT_ATTRIBUTES = frozenset({FRIENDLY_NAME})
+SEARCH_LIMIT = 50
 
 ERRORS_TO_EXCEPT = (
     WebSocketException,
-    WebSocketAddressException,
+    OSError,
     ValueError,
-    ConnectionResetError,
-    BrokenPipeError,
-    SSLEOFError,
+    asyncio.TimeoutError,
 )
 
+# returned instead of a response if a message could not be sent at all
+NOT_SENT = Envelope({})
+# returned instead of a response if a message was sent but the connection was lost before the answer
+NO_RESPONSE = Envelope({})
+# returned instead of a response if a message was sent but the answer didn't arrive in time
+TIMED_OUT = Envelope({})
+
 
-class HomeAssistantBackend:
+class HomeAssistantBackend:  # pylint: disable=too-many-public-methods
     """
     Defines the Home Assistant backend.
+
+    All socket I/O, timers and reconnects run as tasks on a single event loop thread. The public
+    methods may be called from any other thread and block until the event loop has answered them.
+    Action callbacks are queued for a separate callback thread, so they are free to call back into
+    the backend.
     """
 
-    def __init__(self):
-        self._websocket: Optional[WebSocket] = None
-        self._changes_websocket: Optional[WebSocket] = None
+    def __init__(self):  # pylint: disable=too-many-statements
+        self._websocket: Optional[ClientConnection] = None
+        self._changes_websocket: Optional[ClientConnection] = None
         self._message_id: int = 0
-        self._domains: List[str] = []
-        self._entities: Dict[str, Dict[str, Any]] = {}
+        self._index = EntityIndex()
+        self._store = EntityStore()
+        self._pool = ValuePool()
         self._services: Dict[str, Dict[str, Any]] = {}
         self._host: str = ""
         self._port: str = ""
         self._ssl: bool = True
         self._verify_certificate: bool = True
         self._token: str = ""
+        self._single_socket: bool = False
+        self._snapshot_path: Optional[str] = None
+        self._snapshot_handle: Optional[asyncio.TimerHandle] = None
+        self._warm_start: bool = False
+        # whether keys may have been drawn as unavailable or stale since the last connection
+        self._keys_show_unavailable: bool = True
+        self._offline_grace_period: int = const.DEFAULT_OFFLINE_GRACE_PERIOD
+        self._show_stale: bool = const.DEFAULT_SHOW_STALE
+        self._grace_period_handle: Optional[asyncio.TimerHandle] = None
+        self._compression: bool = True
+        self._transfer = TransferCounter()
         self._connection_status_callback: Callable = lambda _1, _2=None: None
-        self._keep_alive_thread: Optional[Thread] = None
-        self._reconnect_thread: Optional[Thread] = None
         self._pending_actions: List[Callable] = []
-        self._entities_update_semaphore = Semaphore(1)
-        self._websocket_semaphore = Semaphore(1)
-        self._tracked_entities: Dict[str, Set[Callable]] = {}
+        self._registry = SubscriptionRegistry(self._on_key_collected)
+        self._event_handlers: Dict[int, Callable[[Envelope], None]] = {}
+        self._entities_subscription_id: int = -1
+        self._subscribed_entity_ids: Set[str] = set()
+        self._subscription_update_handle: Optional[asyncio.TimerHandle] = None
+        self._registry_subscriptions: Dict[str, int] = {}
+        self._incomplete_service_domains: Set[str] = set()
+        self._required_attributes: Dict[str, Dict[str, Optional[FrozenSet[str]]]] = {}
+        self._projections: Dict[str, Optional[FrozenSet[str]]] = {}
+        self._entities_to_fetch: Set[str] = set()
+        self._entity_fetch_handle: Optional[asyncio.TimerHandle] = None
+        self._connect_lock = asyncio.Lock()
+        self._correlator = RequestCorrelator()
+        self._request_timeouts: int = 0
+        self._frames_received: int = 0
+        self._messages_received: int = 0
+        self._max_missed_pongs: int = const.DEFAULT_MAX_MISSED_PONGS
+        self._missed_pongs: int = 0
+        self._rtt = LatencyHistogram(RTT_BUCKETS, RTT_WINDOW)
+        self._command_timeouts: int = 0
+        self._codec = get_default_codec()
+        self._recv_loop_tasks: List[asyncio.Task] = []
+        self._keep_alive_task: Optional[asyncio.Task] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._backoff = Backoff(RETRY_INITIAL_DELAY, RETRY_MAX_DELAY, RETRY_BACKOFF_FACTOR, RETRY_JITTER)
+        self._retry_wakeup = asyncio.Event()
+        self._waiting_for_start: bool = False
+        self._started_subscription_id: int = -1
+        self._dispatcher = CallbackDispatcher("HomeAssistantCallbacks")
+        self._loop = asyncio.new_event_loop()
+        self._coalescer = UpdateCoalescer(self._loop, self._dispatcher.submit_update,
+                                         const.DEFAULT_MAX_UPDATE_RATE)
+        self._loop_thread = Thread(
+            target=self._run_event_loop, name="HomeAssistantEventLoop", daemon=True
+        )
+        self._loop_thread.start()
 
     def set_host(self, host: str) -> None:
         """Set the Home Assistant host."""
@@ -97,127 +191,329 @@ class HomeAssistantBackend:
             return
         self._token = token
 
+    def set_single_socket(self, single_socket: bool) -> None:
+        """Set whether commands and events share a single websocket connection."""
+        if self._single_socket == single_socket:
+            return
+        self._single_socket = single_socket
+
+    def set_compression(self, compression: bool) -> None:
+        """Set whether the websocket connections are compressed."""
+        if self._compression == compression:
+            return
+        self._compression = compression
+
+    def set_max_update_rate(self, max_update_rate: float) -> None:
+        """Set the maximum number of entity updates per second delivered to each key."""
+        self._loop.call_soon_threadsafe(self._coalescer.set_max_rate, max_update_rate)
+
+    def set_max_missed_pongs(self, max_missed_pongs: int) -> None:
+        """Set after how many unanswered heartbeats in a row the connection is considered lost."""
+        self._max_missed_pongs = max_missed_pongs
+
+    def set_offline_grace_period(self, offline_grace_period: int) -> None:
+        """
+        Set for how many seconds the keys keep showing the last known states after the connection
+        was lost, before they are shown as unavailable. 0 shows them as unavailable immediately.
+        """
+        self._offline_grace_period = offline_grace_period
+
+    def set_show_stale(self, show_stale: bool) -> None:
+        """Set whether keys are marked as stale while the offline grace period lasts."""
+        self._show_stale = show_stale
+
     def set_connection_status_callback(self, callback: Callable) -> None:
         """Set a callback to be called when the connection state changes."""
         self._connection_status_callback = callback
 
+    def _run_event_loop(self) -> None:
+        """Run the event loop that handles all communication with Home Assistant."""
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _run_coroutine(self, coroutine: Coroutine, default: Any = None) -> Any:
+        """
+        Run a coroutine on the event loop and block until it has finished, but no longer than
+        COMMAND_TIMEOUT. After that the default is returned and the coroutine finishes in the
+        background, so connection attempts are never interrupted halfway.
+        """
+        if current_thread() is self._loop_thread:
+            # never block the event loop on itself - run the coroutine in the background instead
+            self._loop.create_task(coroutine)
+            return default
+        try:
+            return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(COMMAND_TIMEOUT)
+        except FutureTimeoutError:
+            self._command_timeouts += 1
+            log.error(f"Home Assistant command {coroutine.__name__} did not finish in time")
+            return default
+
+    def _dispatch(self, callback: Callable, *args) -> None:
+        """Execute an action callback on the callback thread."""
+        self._dispatcher.submit(callback, *args)
+
     def reconnect(self) -> bool:
         """Disconnect from Home Assistant and then connect again."""
-        self._disconnect()
-        success = self._connect()
+        return self._run_coroutine(self._reconnect(), False)
+
+    def reconnect_async(self) -> Future:
+        """
+        Disconnect from Home Assistant and then connect again without waiting for the connection.
+        :return: a future that receives whether the connection was established
+        """
+        return asyncio.run_coroutine_threadsafe(self._reconnect(), self._loop)
+
+    async def _reconnect(self) -> bool:
+        """Disconnect from Home Assistant and then connect again."""
+        await self._disconnect()
+        success = await self._connect()
+        if not success and not self._waiting_for_start:
+            self._end_warm_start()
         if not success and self._host and self._token and self._port:
-            if not self._reconnect_thread or not self._reconnect_thread.is_alive():
-                self._reconnect_thread = Thread(
-                    target=self._retry_connect, daemon=True
-                )
-                self._reconnect_thread.start()
+            self._schedule_retry()
         return success
 
-    def _connect(self) -> bool:
+    async def _connect(self) -> bool:
         """Connect to Home Assistant."""
-        if self.is_connected():
-            return True
+        async with self._connect_lock:
+            if self.is_connected():
+                return True
+            if self._waiting_for_start:
+                # the connection is completed as soon as Home Assistant has started
+                return False
 
-        self._connection_status_callback(const.CONNECTING)
+            self._connection_status_callback(const.CONNECTING)
 
-        if not self._host or not self._token or not self._port:
-            self._connection_status_callback(const.NOT_CONNECTED)
-            return False
+            if not self._host or not self._token or not self._port:
+                self._connection_status_callback(const.NOT_CONNECTED)
+                return False
 
-        if self._websocket and self._websocket.connected:
-            self._websocket.close()
-        if self._changes_websocket and self._changes_websocket.connected:
-            self._changes_websocket.close()
+            if not await self._open_websockets():
+                self._connection_status_callback(const.NOT_CONNECTED)
+                return False
+
+            running = await self._bootstrap()
+            if not running:
+                if running is None:
+                    await self._close_websockets()
+                    self._connection_status_callback(const.NOT_CONNECTED)
+                else:
+                    await self._wait_for_start()
+                return False
+
+        await self._on_connected()
+        return True
+
+    async def _open_websockets(self) -> bool:
+        """
+        Open and authenticate the websockets to Home Assistant.
+        :return: whether all websockets were opened
+        """
+        await self._close_websockets()
 
         self._connection_status_callback(const.AUTHENTICATING)
 
-        self._websocket = self._auth()
+        self._websocket = await self._auth()
         if not self._websocket:
-            self._connection_status_callback(const.NOT_CONNECTED)
             return False
+        self._start_recv_loop(self._websocket)
+
+        if self._single_socket:
+            # events are demultiplexed from the command connection by their subscription id
+            self._changes_websocket = self._websocket
+        else:
+            self._changes_websocket = await self._auth()
+            if not self._changes_websocket:
+                await self._close_websockets()
+                return False
+            self._start_recv_loop(self._changes_websocket)
+        return True
 
-        self._changes_websocket = self._auth()
-        if not self._changes_websocket:
-            self._websocket.close()
-            self._connection_status_callback(const.NOT_CONNECTED)
-            return False
+    async def _bootstrap(self) -> Optional[bool]:
+        """
+        Load the config, entities and services from Home Assistant.
+        :return: whether Home Assistant is running; False if it hasn't finished starting yet, None
+        if the config could not be loaded
+        """
+        # subscribe before loading, so no change between loading and subscribing is missed
+        await self._subscribe_registry_events()
 
+        # send all bootstrap requests at once; every cache is built as soon as its reply arrives
         message = self._create_message("get_config")
-        config = self._send_and_wait_for_response_with_semaphore(message)
-        result: Dict[str, dict] = _get_field_from_message(config, FIELD_RESULT)
-
-        if not result or result.get("state", "") != "RUNNING":
-            # Home Assistant hasn't finished starting yet so not all entities
-            # might have been initialized - try again later
-            self._websocket.close()
-            self._changes_websocket.close()
-            self._connection_status_callback(const.NOT_CONNECTED)
-            log.info("Home Assistant not fully started - retrying")
-            return False
+        config_task = self._loop.create_task(self._send_and_wait_for_response(message))
+        entities_task = self._loop.create_task(self._load_domains_and_entities())
+        services_task = self._loop.create_task(self._load_services())
+
+        config = await config_task
+        if not _is_running(config):
+            # not all entities might have been initialized yet
+            entities_task.cancel()
+            services_task.cancel()
+            # a config that didn't arrive says nothing about Home Assistant starting
+            return False if config.is_success() else None
 
         log.info("Connected to Home Assistant")
         self._connection_status_callback(const.CONNECTED)
 
-        Thread(target=self._async_run_recv_loop, daemon=True).start()
+        await asyncio.gather(entities_task, services_task)
 
-        if not self._keep_alive_thread or not self._keep_alive_thread.is_alive():
-            self._keep_alive_thread = Thread(
-                target=self._keep_alive, daemon=True
-            )
-            self._keep_alive_thread.start()
+        self._start_keep_alive()
+        return True
 
-        with self._entities_update_semaphore:
-            self._load_domains_and_entities()
+    def _start_keep_alive(self) -> None:
+        """Start sending heartbeats unless this is already happening."""
+        if not self._keep_alive_task or self._keep_alive_task.done():
+            self._keep_alive_task = self._loop.create_task(self._keep_alive())
+
+    async def _on_connected(self) -> None:
+        """Restore the subscriptions and notify all actions once the connection is established."""
+        self._backoff.reset()
+        self._warm_start = False
+        self._cancel_grace_period()
+        self._schedule_snapshot()
+        await self._resubscribe_tracked_entities()
+
+        # actions waiting for the first connection only need to run once
+        pending_actions, self._pending_actions = self._pending_actions, []
+        for action in pending_actions:
+            self._dispatch(action)
+
+        if self._keys_show_unavailable:
+            # keys may have been drawn as unavailable - changed entities were already notified
+            # by the resync otherwise
+            self._keys_show_unavailable = False
+            for action in self._registry.get_all_callbacks():
+                self._dispatch(action)
+
+    async def _wait_for_start(self) -> None:
+        """
+        Keep the connection open while Home Assistant is starting and complete it once the
+        homeassistant_started event arrives, instead of polling with new connections.
+        """
+        message = self._create_message("subscribe_events")
+        message["event_type"] = "homeassistant_started"
+        self._started_subscription_id = await self._subscribe(message, self._handle_started_event)
+        if self._started_subscription_id == -1:
+            await self._close_websockets()
+            self._connection_status_callback(const.NOT_CONNECTED)
+            return
 
-        for action in self._pending_actions:
-            action()
-        for actions in self._tracked_entities.values():
-            for action in actions:
-                action()
+        self._waiting_for_start = True
+        self._connection_status_callback(const.WAITING_FOR_START)
+        log.info("Home Assistant not fully started - waiting for it")
+        # the heartbeat detects a connection that dies while waiting
+        self._start_keep_alive()
 
-        return True
+        # Home Assistant might have finished starting before the subscription was active
+        config = await self._send_and_wait_for_response(self._create_message("get_config"))
+        if not config.is_success():
+            await self._close_websockets()
+            self._connection_status_callback(const.NOT_CONNECTED)
+        elif _is_running(config):
+            self._loop.create_task(self._resume_after_start())
+
+    def _handle_started_event(self, _: Envelope) -> None:
+        """Complete the connection once Home Assistant has started."""
+        self._loop.create_task(self._resume_after_start())
+
+    async def _resume_after_start(self) -> None:
+        """Complete a connection that was waiting for Home Assistant to start."""
+        async with self._connect_lock:
+            if not self._waiting_for_start:
+                return
+            self._waiting_for_start = False
+            await self._unsubscribe(self._started_subscription_id)
+            self._started_subscription_id = -1
 
-    def _disconnect(self) -> None:
+            running = await self._bootstrap()
+            if running is None:
+                await self._close_websockets()
+                self._connection_status_callback(const.NOT_CONNECTED)
+            elif not running:
+                await self._wait_for_start()
+            if not self.is_connected():
+                if not self._waiting_for_start:
+                    self._schedule_retry()
+                return
+
+        await self._on_connected()
+
+    async def _disconnect(self) -> None:
         """Disconnect from Home Assistant."""
         self._connection_status_callback(const.DISCONNECTING)
+        if not self._warm_start:
+            self._keys_show_unavailable = True
 
-        if self._websocket and self._websocket.connected:
-            self._websocket.close()
-            self._websocket = None
-        if self._changes_websocket and self._changes_websocket.connected:
-            self._changes_websocket.close()
-            self._changes_websocket = None
+        for task in self._recv_loop_tasks:
+            if task is not asyncio.current_task():
+                task.cancel()
+        self._recv_loop_tasks = []
 
-        self._websocket_semaphore = Semaphore(1)
-        self._entities_update_semaphore = Semaphore(1)
+        await self._close_websockets()
         self._message_id = 0
 
         self._connection_status_callback(const.NOT_CONNECTED)
 
-    def _auth(self) -> Optional[WebSocket]:
+    async def _close_websockets(self) -> None:
+        """Close both websockets and fail all requests still waiting for a response."""
+        websockets = {self._websocket, self._changes_websocket}
+        self._websocket = None
+        self._changes_websocket = None
+        self._event_handlers = {}
+        self._entities_subscription_id = -1
+        self._subscribed_entity_ids = set()
+        self._started_subscription_id = -1
+        self._registry_subscriptions = {}
+        self._waiting_for_start = False
+        self._coalescer.flush()
+        self._correlator.fail_all(ConnectionError("Connection to Home Assistant closed"))
+        for websocket in websockets:
+            if websocket:
+                await websocket.close()
+
+    async def _auth(self) -> Optional[ClientConnection]:
         websocket_host = (
             f'{"wss://" if self._ssl else "ws://"}{self._host}:{self._port}{HASS_WEBSOCKET_API}'
         )
-        ssl_opt = {}
-        if not self._verify_certificate:
-            ssl_opt["cert_reqs"] = CERT_NONE
-
+        ssl_context = None
+        if self._ssl:
+            ssl_context = create_default_context()
+            if not self._verify_certificate:
+                ssl_context.check_hostname = False
+                ssl_context.verify_mode = CERT_NONE
+
+        new_websocket = None
         try:
-            new_websocket = create_connection(websocket_host, sslopt=ssl_opt)
-            auth_required = new_websocket.recv()
-            auth_required = _get_field_from_message(auth_required, FIELD_TYPE)
-            if not auth_required:
+            new_websocket = await connect(
+                websocket_host,
+                ssl=ssl_context,
+                compression=None,
+                extensions=[CountingPerMessageDeflateFactory(self._transfer)]
+                if self._compression else None,
+                open_timeout=OPEN_TIMEOUT,
+                close_timeout=CLOSE_TIMEOUT,
+                ping_interval=None,
+                max_size=None,
+            )
+            auth_required = decode(await new_websocket.recv(), self._codec)
+            if not auth_required or not auth_required.get_type():
                 log.error("Could not auth with Home Assistant")
+                await new_websocket.close()
                 return None
 
-            new_websocket.send(
-                json.dumps({FIELD_TYPE: "auth", "access_token": self._token})
+            await new_websocket.send(
+                self._codec.dumps({FIELD_TYPE: "auth", "access_token": self._token})
             )
-            auth_ok = new_websocket.recv()
-            auth_ok = _get_field_from_message(auth_ok, FIELD_TYPE)
-            if not auth_ok or auth_ok != "auth_ok":
+            auth_ok = decode(await new_websocket.recv(), self._codec)
+            if not auth_ok or auth_ok.get_type() != "auth_ok":
                 log.error("Could not auth with Home Assistant")
+                await new_websocket.close()
                 return None
+
+            # allow Home Assistant to send many messages in one frame; the result is not needed
+            features = self._create_message("supported_features")
+            features["features"] = {"coalesce_messages": 1}
+            await new_websocket.send(self._codec.dumps(features))
         except SSLError:
             error = "An SSL error occurred. Is the server certificate valid?"
             if self._verify_certificate:
@@ -233,205 +529,548 @@ class HomeAssistantBackend:
                 f" 'websocket_api' is enabled in your Home Assistant configuration."
             )
             return None
-        except ERRORS_TO_EXCEPT as e:
+        except (InvalidURI, *ERRORS_TO_EXCEPT) as e:
             log.error(f"Could not connect to {websocket_host}: {e}")
+            if new_websocket:
+                await new_websocket.close()
             return None
 
         return new_websocket
 
-    def _async_run_recv_loop(self):
-        # wait for entities update finishing
-        with self._entities_update_semaphore:
-            pass
-
-        if self._entities:
-            # if the connection was lost we might need to resubscribe to entity events
-            for domain, domain_entry in self._entities.items():
-                for entity, entity_settings in domain_entry.items():
-                    if entity_settings.get("keys"):
-                        action_items = entity_settings["keys"].items()
-                        entity_settings["subscription_id"] = -1
-                        entity_settings["keys"] = {}
-                        for action_uid, action in action_items:
-                            self.add_tracked_entity(entity, action_uid, action)
-
-        while self._changes_websocket and self._changes_websocket.connected:
+    def _start_recv_loop(self, websocket: ClientConnection) -> None:
+        """Start receiving messages from the websocket."""
+        self._recv_loop_tasks = [task for task in self._recv_loop_tasks if not task.done()]
+        self._recv_loop_tasks.append(self._loop.create_task(self._run_recv_loop(websocket)))
+
+    async def _run_recv_loop(self, websocket: ClientConnection) -> None:
+        """Receive and handle messages until the connection is lost."""
+        while True:
             try:
-                message = self._changes_websocket.recv()
+                frame = await websocket.recv()
             except ERRORS_TO_EXCEPT as e:
                 log.info(f"Connection closed; quitting recv() loop: {e}")
                 break
 
-            if not message:
+            if not frame:
                 # received an empty message - happens when Home Assistants shuts down; ignore
                 continue
 
-            message_type = _get_field_from_message(message, FIELD_TYPE)
-            if FIELD_EVENT == message_type:
-                new_state = (
-                    json.loads(message)
-                    .get(FIELD_EVENT, {})
-                    .get("variables", {})
-                    .get("trigger", {})
-                    .get("to_state", {})
-                )
-                if not new_state:
-                    entity_id = (
-                        json.loads(message)
-                        .get(FIELD_EVENT, {})
-                        .get("variables", {})
-                        .get("trigger", {})
-                        .get("from_state", {})
-                        .get(ENTITY_ID)
-                    )
-                    entity_settings = self._entities[entity_id.split(".")[0]].get(entity_id)
-                    actions = entity_settings.get("keys", {}).values()
-                    for action_entity_updated in actions:
-                        action_entity_updated()
-                    return
-
-                entity_id = new_state.get(ENTITY_ID)
-                domain = entity_id.split(".")[0]
-                entity_settings = self._entities[domain].get(entity_id)
-                actions = entity_settings.get("keys", {}).values()
-                state = new_state.get(const.STATE)
-                attributes = new_state.get(const.ATTRIBUTES, {})
-
-                self._entities[domain][entity_id][const.STATE] = state
-                self._entities[domain][entity_id][const.ATTRIBUTES] = attributes
-
-                update_state = {
-                    const.STATE: state,
-                    const.ATTRIBUTES: attributes,
-                    const.HA_CONNECTED: self.is_connected(),
-                }
-                for action_entity_updated in actions:
-                    action_entity_updated(update_state)
-
-        self._disconnect()
-        for actions in self._tracked_entities.values():
-            for action in actions:
-                action()
-
-        if not self._reconnect_thread or not self._reconnect_thread.is_alive():
-            self._reconnect_thread = Thread(
-                target=self._retry_connect, daemon=True
+            # every frame is parsed exactly once; all consumers share the resulting envelopes
+            envelopes = decode_batch(frame, self._codec)
+            self._frames_received += 1
+            self._messages_received += len(envelopes)
+            for envelope in envelopes:
+                self._handle_envelope(envelope)
+
+        if websocket not in (self._websocket, self._changes_websocket):
+            # the connection was closed on purpose - no need to react to it
+            return
+
+        await self._handle_connection_lost()
+
+    def _handle_envelope(self, envelope: Envelope) -> None:
+        """Route a received message to the request or subscription it belongs to."""
+        message_type = envelope.get_type()
+        if message_type in (TYPE_RESULT, TYPE_PONG):
+            self._correlator.resolve(envelope.get_id(), envelope)
+        elif message_type == TYPE_EVENT:
+            handler = self._event_handlers.get(envelope.get_id())
+            if handler:
+                handler(envelope)
+
+    async def _handle_connection_lost(self) -> None:
+        """
+        Close the connection and start reconnecting. The actions are informed once the offline
+        grace period has passed without a new connection.
+        """
+        self._warm_start = False
+        await self._disconnect()
+        if self._offline_grace_period > 0:
+            if not self._grace_period_handle:
+                self._start_grace_period()
+        else:
+            for action in self._registry.get_all_callbacks():
+                self._dispatch(action)
+
+        self._schedule_retry()
+
+    def _start_grace_period(self) -> None:
+        """
+        Keep the keys showing the last known states for a while, so a short outage doesn't redraw
+        every key twice. With stale markers enabled, the keys are redrawn once to show them.
+        """
+        self._grace_period_handle = self._loop.call_later(self._offline_grace_period,
+                                                          self._end_grace_period)
+        # the keys weren't redrawn - after reconnecting only changed entities need to be shown
+        self._keys_show_unavailable = self._show_stale
+        if self._show_stale:
+            for action in self._registry.get_all_callbacks():
+                self._dispatch(action)
+
+    def _end_grace_period(self) -> None:
+        """Show all keys as unavailable because the connection wasn't established in time."""
+        self._grace_period_handle = None
+        if self.is_connected():
+            return
+        self._keys_show_unavailable = True
+        for action in self._registry.get_all_callbacks():
+            self._dispatch(action)
+
+    def _cancel_grace_period(self) -> None:
+        """Stop waiting for the offline grace period to pass."""
+        if self._grace_period_handle:
+            self._grace_period_handle.cancel()
+            self._grace_period_handle = None
+
+    async def _subscribe_registry_events(self) -> None:
+        """Subscribe to the events that keep the caches up to date without reloading them."""
+        handlers = {
+            EVENT_SERVICE_REGISTERED: self._handle_service_registered,
+            EVENT_SERVICE_REMOVED: self._handle_service_removed,
+            EVENT_ENTITY_REGISTRY_UPDATED: self._handle_entity_registry_updated,
+        }
+        for event_type, handler in handlers.items():
+            if event_type in self._registry_subscriptions:
+                continue
+            message = self._create_message("subscribe_events")
+            message["event_type"] = event_type
+            subscription_id = await self._subscribe(message, handler)
+            if subscription_id > -1:
+                self._registry_subscriptions[event_type] = subscription_id
+
+    def _handle_service_registered(self, envelope: Envelope) -> None:
+        """
+        Add a newly registered service to the cache. The event doesn't contain the fields of the
+        service, so they are loaded when the services of the domain are requested the next time.
+        """
+        data = envelope.get_event().get(FIELD_DATA, {})
+        domain = data.get(FIELD_DOMAIN)
+        service = data.get(FIELD_SERVICE)
+        if not domain or not service:
+            return
+        self._services.setdefault(domain, {}).setdefault(service, {})
+        self._incomplete_service_domains.add(domain)
+        self._schedule_snapshot()
+
+    def _handle_service_removed(self, envelope: Envelope) -> None:
+        """Remove a service from the cache."""
+        data = envelope.get_event().get(FIELD_DATA, {})
+        domain = data.get(FIELD_DOMAIN)
+        services = self._services.get(domain)
+        if services is None:
+            return
+        services.pop(data.get(FIELD_SERVICE), None)
+        if not services:
+            self._services.pop(domain)
+            self._incomplete_service_domains.discard(domain)
+        self._schedule_snapshot()
+
+    def _handle_entity_registry_updated(self, envelope: Envelope) -> None:
+        """Add, remove or rename an entity in the cache when the entity registry changes."""
+        data = envelope.get_event().get(FIELD_DATA, {})
+        action = data.get("action")
+        entity_id = data.get(ENTITY_ID)
+        if not entity_id or "." not in entity_id:
+            return
+
+        if action == REGISTRY_ACTION_CREATE:
+            self._add_entity(entity_id)
+        elif action == REGISTRY_ACTION_REMOVE:
+            self._remove_entity(entity_id)
+        elif action == REGISTRY_ACTION_UPDATE and data.get("old_entity_id"):
+            self._remove_entity(data["old_entity_id"])
+            self._add_entity(entity_id)
+
+    def _add_entity(self, entity_id: str) -> None:
+        """
+        Add a new entity to the cache. Its state usually doesn't exist yet when the entity is
+        registered, so the states of new entities are fetched shortly after.
+        """
+        entity = self._store.get(entity_id) or self._store.publish(entity_id, "unavailable", {})
+        self._index.add(entity_id, entity)
+        self._schedule_entity_fetch(entity_id)
+
+    def _schedule_entity_fetch(self, entity_id: str) -> None:
+        """Fetch the state of an entity shortly, together with all others scheduled meanwhile."""
+        self._entities_to_fetch.add(entity_id)
+        if not self._entity_fetch_handle:
+            self._entity_fetch_handle = self._loop.call_later(
+                ENTITY_FETCH_DELAY, lambda: self._loop.create_task(self._fetch_new_entities())
             )
-            self._reconnect_thread.start()
+
+    def _remove_entity(self, entity_id: str) -> None:
+        """Remove an entity from the cache and inform the actions showing it."""
+        if self._store.remove(entity_id) is None:
+            return
+
+        self._index.remove(entity_id)
+        self._entities_to_fetch.discard(entity_id)
+        self._schedule_snapshot()
+        self._notify_removed(entity_id)
+
+    async def _fetch_new_entities(self) -> None:
+        """Fetch the states of all entities scheduled since the last fetch."""
+        self._entity_fetch_handle = None
+        entity_ids = self._entities_to_fetch
+        self._entities_to_fetch = set()
+
+        for entity_id, compressed_state in (await self._fetch_entity_states(entity_ids)).items():
+            entity = self._store.get(entity_id)
+            if entity:
+                self._update_entity(entity_id, *state_delta.apply_compressed_state(
+                    entity, compressed_state, self._pool, self._get_projection(entity_id)
+                ))
+
+    async def _fetch_entity_states(self, entity_ids: Set[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Fetch the current states of some entities with a subscribe_entities subscription that is
+        cancelled again after its first event.
+        :return: the compressed states by entity id; entities without a state are missing
+        """
+        if not entity_ids or not self.is_connected():
+            return {}
+
+        states = self._loop.create_future()
+
+        def handle_event(envelope: Envelope) -> None:
+            if not states.done():
+                states.set_result(envelope.get_event().get(state_delta.ENTITIES_ADDED, {}))
+
+        message = self._create_message("subscribe_entities")
+        message["entity_ids"] = sorted(entity_ids)
+        subscription_id = await self._subscribe(message, handle_event)
+        if subscription_id == -1:
+            return {}
+
+        try:
+            return await asyncio.wait_for(states, REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.error(f"No states received for {entity_ids}")
+            return {}
+        finally:
+            await self._unsubscribe(subscription_id)
+
+    async def _resubscribe_tracked_entities(self) -> None:
+        """Subscribe to the events of all tracked entities again after the connection was lost."""
+        await self._update_entities_subscription()
+
+    def _schedule_entities_subscription_update(self) -> None:
+        """
+        Update the entity subscription shortly. Changes to the tracked entities within the delay,
+        e.g. while a page of keys is being loaded, are combined into a single subscription.
+        """
+        if self._subscription_update_handle:
+            return
+
+        def update():
+            self._subscription_update_handle = None
+            self._loop.create_task(self._update_entities_subscription())
+
+        self._subscription_update_handle = self._loop.call_later(SUBSCRIPTION_UPDATE_DELAY, update)
+
+    async def _update_entities_subscription(self) -> None:
+        """
+        Subscribe to all tracked entities with a single subscribe_entities message. Home Assistant
+        does not allow changing the entities of a subscription, so a new subscription replaces
+        the previous one.
+        """
+        entity_ids = self._registry.get_entity_ids()
+        if not self.is_connected() or entity_ids == self._subscribed_entity_ids:
+            return
+
+        old_subscription_id = self._entities_subscription_id
+        self._subscribed_entity_ids = entity_ids
+        self._entities_subscription_id = -1
+
+        if entity_ids:
+            # subscribe first to not miss any updates in between
+            message = self._create_message("subscribe_entities")
+            message["entity_ids"] = sorted(entity_ids)
+            self._entities_subscription_id = await self._subscribe(
+                message, self._handle_entities_event
+            )
+
+        if old_subscription_id > -1:
+            await self._unsubscribe(old_subscription_id)
+
+    def _handle_entities_event(self, envelope: Envelope) -> None:
+        """
+        Update the entity cache from a subscribe_entities event and notify the actions tracking
+        the entities.
+        """
+        event = envelope.get_event()
+
+        for entity_id, compressed_state in event.get(state_delta.ENTITIES_ADDED, {}).items():
+            # sent for all entities when subscribing - only changed entities are notified
+            entity = self._store.get(entity_id)
+            if entity:
+                self._update_entity(entity_id, *state_delta.apply_compressed_state(
+                    entity, compressed_state, self._pool, self._get_projection(entity_id)
+                ))
+            else:
+                self._restore_entity(entity_id, compressed_state)
+
+        for entity_id, diff in event.get(state_delta.ENTITIES_CHANGED, {}).items():
+            entity = self._store.get(entity_id)
+            if entity:
+                self._update_entity(entity_id, *state_delta.apply_diff(
+                    entity, diff, self._pool, self._get_projection(entity_id)
+                ))
+
+        for entity_id in event.get(state_delta.ENTITIES_REMOVED, []):
+            self._remove_entity(entity_id)
+
+    def _restore_entity(self, entity_id: str, compressed_state: Dict[str, Any]) -> None:
+        """
+        Add an entity that was removed and added again, e.g. because its integration was
+        reloaded, back to the cache and inform the actions showing it.
+        """
+        entity = self._store.publish(
+            entity_id,
+            self._pool.share(compressed_state.get(state_delta.COMPRESSED_STATE)),
+            self._pool.share_attributes(state_delta.project(
+                compressed_state.get(state_delta.COMPRESSED_ATTRIBUTES, {}),
+                self._get_projection(entity_id)
+            )),
+        )
+        self._index.add(entity_id, entity)
+        self._schedule_snapshot()
+        self._notify_updated(entity_id, entity, {const.STATE, *entity.attributes})
+
+    def _update_entity(
+        self, entity_id: str, state: Any, attributes: Dict[str, Any], changed: Set[str]
+    ) -> None:
+        """
+        Publish the new state of an entity and notify the actions tracking it about the changed
+        fields.
+        """
+        if not changed:
+            return
+        entity = self._store.publish(entity_id, state, attributes)
+        if FRIENDLY_NAME in changed:
+            self._index.update_name(entity_id, entity)
+        self._schedule_snapshot()
+        self._notify_updated(entity_id, entity, changed)
+
+    def _notify_updated(self, entity_id: str, entity: EntityRecord, changed: Set[str]) -> None:
+        """Notify the actions tracking an entity about the changed fields of the entity."""
+        update_state = {
+            const.STATE: entity.state,
+            const.ATTRIBUTES: entity.attributes,
+            const.HA_CONNECTED: self.is_connected(),
+            const.HA_STALE: False,
+            const.CHANGED_FIELDS: frozenset(changed),
+            const.VERSION: entity.version,
+        }
+        for uid, action_entity_updated in self._registry.get_callbacks(entity_id):
+            self._coalescer.submit(uid, action_entity_updated, update_state)
+
+    def _notify_removed(self, entity_id: str) -> None:
+        """Notify the actions tracking an entity that its state no longer exists."""
+        for uid, action_entity_updated in self._registry.get_callbacks(entity_id):
+            self._coalescer.discard(uid)
+            self._dispatch(action_entity_updated)
+
+    def _resync(self, old_entities: Dict[str, Optional[EntityRecord]]) -> None:
+        """
+        Notify the actions about the tracked entities that changed while the cache wasn't kept
+        up to date, e.g. while the connection was down. Unchanged entities are not notified.
+        :param old_entities: the records of the tracked entities before the cache was reloaded
+        """
+        for entity_id, old_entity in old_entities.items():
+            entity = self._store.get(entity_id)
+            if entity is None:
+                if old_entity is not None:
+                    self._notify_removed(entity_id)
+            elif old_entity is None:
+                self._notify_updated(entity_id, entity, {const.STATE, *entity.attributes})
+            else:
+                changed = state_delta.get_changed_fields(old_entity, entity.state,
+                                                         entity.attributes)
+                if changed:
+                    self._notify_updated(entity_id, entity, changed)
 
     def get_domains(self) -> List[str]:
         """Get a list of all domains known to Home Assistant."""
-        if not self._connect():
+        return self._run_coroutine(self._get_domains(), [])
+
+    async def _get_domains(self) -> List[str]:
+        if not self._warm_start and not await self._connect():
             return []
-        if not self._domains:
-            self._load_domains_and_entities()
-        return self._domains
+        if self._store.is_empty():
+            await self._load_domains_and_entities()
+        return self._index.get_domains()
+
+    def search_entities(self, query: str, domain: Optional[str] = None) -> List[str]:
+        """
+        Search the entities by id and friendly name.
+        :param query: the text to search for
+        :param domain: only search the entities of this domain
+        :return: the matching entity ids, best matches first
+        """
+        return self._run_coroutine(self._search_entities(query, domain), [])
+
+    async def _search_entities(self, query: str, domain: Optional[str]) -> List[str]:
+        if not self._warm_start and not await self._connect():
+            return []
+        if self._store.is_empty():
+            await self._load_domains_and_entities()
+        return self._index.search(query, domain, SEARCH_LIMIT)
 
     def get_entity(self, entity_id: str) -> Dict[str, Any]:
-        """Return the entity state with the requested name."""
-        entity_fallback_dict = {
-            const.STATE: "N/A",
-            const.ATTRIBUTES: {},
-            const.HA_CONNECTED: self.is_connected(),
+        """
+        Return the entity state with the requested name. Doesn't block: the state is read from
+        the latest published record, whose attributes must not be changed.
+        """
+        entity = self._store.get(entity_id) if entity_id and "." in entity_id else None
+
+        return {
+            const.STATE: entity.state if entity else "N/A",
+            const.ATTRIBUTES: entity.attributes if entity else {},
+            const.HA_CONNECTED: self._is_available(),
+            const.HA_STALE: self._show_stale and self._grace_period_handle is not None,
+            const.VERSION: entity.version if entity else 0,
         }
-        if not entity_id or "." not in entity_id:
-            return entity_fallback_dict
-
-        domain = entity_id.split(".")[0]
-        entity_dict = self._entities.get(domain, {}).get(entity_id, entity_fallback_dict)
-        entity_dict[const.HA_CONNECTED] = self.is_connected()
-        return entity_dict
 
     def get_entities(self, domain: str) -> List[str]:
         """Return a list of all entities known to Home Assistant."""
-        if not self._connect() or not domain:
+        return self._run_coroutine(self._get_entities(domain), [])
+
+    async def _get_entities(self, domain: str) -> List[str]:
+        if not domain or not self._warm_start and not await self._connect():
             return []
-        if not self._entities:
-            self._load_domains_and_entities()
-        return list(self._entities.get(domain, {}).keys())
+        if self._store.is_empty():
+            await self._load_domains_and_entities()
+        return self._index.get_entities(domain)
 
-    def _load_domains_and_entities(self) -> None:
+    async def _load_domains_and_entities(self) -> None:
         """Loads the domains and entities from Home Assistant."""
         message = self._create_message("get_states")
-        response = self._send_and_wait_for_response_with_semaphore(message)
-        success = _get_field_from_message(response, FIELD_SUCCESS)
-        domains = []
-        entities = {}
+        response = await self._send_and_wait_for_response(message)
+        states = {}
 
-        if not success:
+        if not response.is_success():
             log.error("Error retrieving domains and entities.")
             return
 
-        for entity in _get_field_from_message(response, "result"):
+        for entity in response.get_result() or []:
             entity_id = entity.get(ENTITY_ID)
-            domain = entity_id.split(".")[0]
-            if domain not in domains:
-                domains.append(domain)
-            if domain not in entities:
-                entities[domain] = {}
-            entities[domain][entity_id] = {
-                "state": entity.get("state", "off"),
-                "attributes": entity.get("attributes", {}),
-                "keys": {},
-                "subscription_id": -1,
-            }
-
-        if self._entities:
-            for domain, domain_entry in self._entities.items():
-                for entity_id in domain_entry.keys():
-                    if entities.get(domain, {}).get(entity_id):
-                        entities[domain][entity_id]["keys"] = domain_entry[entity_id].get(
-                            "keys", {}
-                        )
-                        entities[domain][entity_id]["subscription_id"] = domain_entry[
-                            entity_id
-                        ].get("subscription_id", -1)
-
-        self._domains = domains
-        self._entities = entities
+            states[entity_id] = (
+                self._pool.share(entity.get("state", "off")),
+                self._pool.share_attributes(state_delta.project(
+                    entity.get("attributes", {}), self._get_projection(entity_id)
+                )),
+            )
+
+        old_entities = {entity_id: self._store.get(entity_id)
+                        for entity_id in self._registry.get_entity_ids()}
+        self._store.publish_all(states)
+        self._index.rebuild(self._store.get_all())
+        if not self._keys_show_unavailable:
+            # otherwise all keys are redrawn once connected
+            self._resync(old_entities)
 
     def get_services(self, domain: str) -> Dict[str, Dict[str, Any]]:
         """Return all services known to Home Assistant."""
-        if not self._connect() or not domain:
+        return self._run_coroutine(self._get_services(domain), {})
+
+    async def _get_services(self, domain: str) -> Dict[str, Dict[str, Any]]:
+        if not domain or not self._warm_start and not await self._connect():
             return {}
-        if self._services:
-            return self._services.get(domain, {})
+        if not self._services or (domain in self._incomplete_service_domains and self.is_connected()):
+            await self._load_services()
+        return self._services.get(domain, {})
 
+    async def _load_services(self) -> None:
+        """Loads the services from Home Assistant."""
         message = self._create_message("get_services")
-        response = self._send_and_wait_for_response_with_semaphore(message)
-        success = _get_field_from_message(response, FIELD_SUCCESS)
+        response = await self._send_and_wait_for_response(message)
         self._services = {}
+        self._incomplete_service_domains = set()
 
-        if not success:
+        if not response.is_success():
             log.error("Error retrieving services.")
-            return {}
+            return
 
-        self._services = _get_field_from_message(response, FIELD_RESULT)
-        return self._services.get(domain, {})
+        self._services = response.get_result() or {}
 
     def call_service(
-        self, entity_id: str, service: str, data: Optional[Dict[str, Any]] = None
+        self, entity_id: str, service: str, data: Optional[Dict[str, Any]] = None,
+        timeout: float = REQUEST_TIMEOUT
     ) -> None:
-        """Calls a Home Assistant service."""
-        if not self._connect():
-            return
+        """Calls a Home Assistant service and waits for the result."""
+        self._run_coroutine(self._call_service(entity_id, service, data, timeout=timeout))
+
+    def call_service_async(
+        self, entity_id: str, service: str, data: Optional[Dict[str, Any]] = None,
+        callback: Optional[Callable[[ServiceCallResult], None]] = None, retries: int = 0,
+        timeout: float = REQUEST_TIMEOUT
+    ) -> Future:
+        """
+        Calls a Home Assistant service without waiting for the result.
+        :param entity_id: the entity to call the service for
+        :param service: the service to call
+        :param data: the service data
+        :param callback: called on the callback thread with the ServiceCallResult once the call
+        has finished
+        :param retries: how often the call is attempted again if it could not be sent; a call
+        that reached Home Assistant is never sent again, so toggles are not executed twice
+        :param timeout: the time in seconds to wait for the response before the call fails
+        :return: a future that receives the ServiceCallResult
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._call_service(entity_id, service, data, callback, retries, timeout), self._loop
+        )
 
+    async def _call_service(
+        self, entity_id: str, service: str, data: Optional[Dict[str, Any]] = None,
+        callback: Optional[Callable[[ServiceCallResult], None]] = None, retries: int = 0,
+        timeout: float = REQUEST_TIMEOUT
+    ) -> ServiceCallResult:
         domain = entity_id.split(".")[0]
-        message = self._create_message("call_service")
-        message["domain"] = domain
-        message["service"] = service
-        message["target"] = {ENTITY_ID: entity_id}
-        message["service_data"] = data if data else {}
-
-        response = self._send_and_wait_for_response_with_semaphore(message)
-        success = _get_field_from_message(response, FIELD_SUCCESS)
-
-        if not success:
-            # try one more time
-            response = self._send_and_wait_for_response_with_semaphore(message)
-            success = _get_field_from_message(response, FIELD_SUCCESS)
-            if not success:
-                log.error(f"Error calling service {service} for entity {entity_id}.")
+        attempt = 0
+
+        while True:
+            start = monotonic()
+            response = NOT_SENT
+            if await self._connect():
+                message = self._create_message("call_service")
+                message["domain"] = domain
+                message["service"] = service
+                message["target"] = {ENTITY_ID: entity_id}
+                message["service_data"] = data if data else {}
+
+                response = await self._send_and_wait_for_response(message, timeout)
+
+            if response is not NOT_SENT or attempt >= retries:
+                break
+            # the call never reached Home Assistant, so it is safe to send it again
+            attempt += 1
+
+        latency = monotonic() - start
+        if response is NOT_SENT:
+            result = ServiceCallResult(
+                entity_id, service, False, latency, "Not connected to Home Assistant"
+            )
+        elif response is NO_RESPONSE:
+            result = ServiceCallResult(
+                entity_id, service, False, latency, "No response from Home Assistant"
+            )
+        elif response is TIMED_OUT:
+            result = ServiceCallResult(
+                entity_id, service, False, latency, "Home Assistant did not respond in time"
+            )
+        elif not response.is_success():
+            error = response.get_error()
+            result = ServiceCallResult(entity_id, service, False, latency, error or "Unknown error")
+        else:
+            result = ServiceCallResult(entity_id, service, True, latency)
+
+        if not result.is_success():
+            log.error(f"Error calling service {service} for entity {entity_id}: {result.get_error()}")
+        if callback:
+            self._dispatch(callback, result)
+        return result
 
     def _create_message(self, message_type: str) -> Dict[str, Any]:
         """Create a message that can be sent to the Home Assistant websocket."""
@@ -439,115 +1078,394 @@ class HomeAssistantBackend:
         return {ID: self._message_id, FIELD_TYPE: message_type}
 
     def add_tracked_entity(
-        self, entity_id: str, action_uid: str, action_entity_updated: Callable
+        self, entity_id: str, action_uid: str, action_entity_updated: Callable,
+        attributes: Optional[Iterable[str]] = None
     ) -> None:
-        """Register an entity with the Home Assistant websocket to be notified when the entity is updated."""
-        if not entity_id or not self._connect():
+        """
+        Register an entity with the Home Assistant websocket to be notified when the entity is
+        updated. Registering a key again updates the attributes it needs.
+        :param attributes: the attributes the key needs; only the attributes needed by any key are
+        kept and delivered. All attributes are kept if None.
+        """
+        self._run_coroutine(
+            self._add_tracked_entity(entity_id, action_uid, action_entity_updated, attributes)
+        )
+
+    async def _add_tracked_entity(
+        self, entity_id: str, action_uid: str, action_entity_updated: Callable,
+        attributes: Optional[Iterable[str]] = None
+    ) -> None:
+        if not entity_id:
             return
 
-        domain = entity_id.split(".")[0]
-        if not self._entities:
-            self._load_domains_and_entities()
+        required = None if attributes is None else frozenset(attributes)
 
-        entity_settings = self._entities.get(domain, {}).get(entity_id)
-        if not entity_settings:
-            # entity doesn't exist (anymore)
+        if self._registry.contains(entity_id, action_uid):
+            # key already registered - only the attributes it needs may have changed
+            self._registry.add(entity_id, action_uid, action_entity_updated)
+            self._required_attributes.setdefault(entity_id, {})[action_uid] = required
+            self._update_projection(entity_id, True)
             return
 
-        if action_uid in entity_settings.get("keys", {}).keys():
-            # key already registered
+        if not self._warm_start and not await self._connect():
             return
 
-        actions = self._tracked_entities.get(entity_id, set())
-        actions.add(action_entity_updated)
-        self._tracked_entities[entity_id] = actions
+        if self._store.is_empty():
+            await self._load_domains_and_entities()
 
-        entity_settings.get("keys")[action_uid] = action_entity_updated
-
-        if entity_settings.get("subscription_id") > -1:
-            # already subscribed to entity events
+        if not self._store.get(entity_id):
+            # entity doesn't exist (anymore)
             return
 
-        message = self._create_message("subscribe_trigger")
-        message["trigger"] = {"platform": "state", ENTITY_ID: entity_id}
-        self._changes_websocket.send(json.dumps(message))
-        entity_settings["subscription_id"] = message.get(ID)
+        old_entity_id = self._registry.get_entity_id(action_uid)
+        if old_entity_id is not None:
+            # the key showed another entity before
+            await self._remove_tracked_entity(old_entity_id, action_uid)
+
+        first = self._registry.add(entity_id, action_uid, action_entity_updated)
+        self._required_attributes.setdefault(entity_id, {})[action_uid] = required
+        # a newly subscribed entity receives its complete state anyway
+        self._update_projection(entity_id, not first)
+
+        if first:
+            self._schedule_entities_subscription_update()
 
     def remove_tracked_entity(self, entity_id: str, action_uid: str) -> None:
         """Deregister a previously registered entity."""
-        if not entity_id or not self._connect():
+        self._run_coroutine(self._remove_tracked_entity(entity_id, action_uid))
+
+    async def _remove_tracked_entity(self, entity_id: str, action_uid: str) -> None:
+        if not entity_id:
             return
 
-        domain = entity_id.split(".")[0]
-        entity_settings = self._entities[domain].get(entity_id, {})
-        entity_settings.get("keys", {}).pop(action_uid, None)
+        last = self._registry.remove(entity_id, action_uid)
+        self._coalescer.discard(action_uid)
+        self._required_attributes.get(entity_id, {}).pop(action_uid, None)
+        self._update_projection(entity_id, False)
+
+        if last:
+            # no other key shows the entity, so stop the subscription
+            self._schedule_entities_subscription_update()
+
+    def _on_key_collected(self, entity_id: str, action_uid: str, ref: Callable) -> None:
+        """
+        Deregister the key of an action that was deleted without removing its key first. Called
+        by the garbage collector, possibly on any thread.
+        """
+        def remove():
+            if self._registry.is_current(entity_id, action_uid, ref):
+                self._loop.create_task(self._remove_tracked_entity(entity_id, action_uid))
+
+        self._loop.call_soon_threadsafe(remove)
+
+    def get_subscriptions(self) -> Dict[str, List[str]]:
+        """Return the action uids of the keys showing each tracked entity."""
+        return self._run_coroutine(self._get_subscriptions(), {})
+
+    async def _get_subscriptions(self) -> Dict[str, List[str]]:
+        return self._registry.get_subscriptions()
+
+    def _get_projection(self, entity_id: str) -> Optional[FrozenSet[str]]:
+        """Get the attributes kept for an entity; None if all attributes are kept."""
+        return self._projections.get(entity_id, KEPT_ATTRIBUTES)
+
+    def _update_projection(self, entity_id: str, fetch_added: bool) -> None:
+        """
+        Recompute the attributes kept for an entity from the attributes the keys showing it need.
+        Attributes no longer needed are dropped from the cache right away.
+        :param fetch_added: whether to fetch the state of the entity if attributes were added
+        """
+        old_projection = self._get_projection(entity_id)
+        required = self._required_attributes.get(entity_id)
+
+        if not required:
+            self._required_attributes.pop(entity_id, None)
+            self._projections.pop(entity_id, None)
+        elif None in required.values():
+            self._projections[entity_id] = None
+        else:
+            self._projections[entity_id] = KEPT_ATTRIBUTES.union(*required.values())
+
+        projection = self._get_projection(entity_id)
+        entity = self._store.get(entity_id)
+        if projection == old_projection or not entity:
+            return
+
+        if projection is not None and any(name not in projection for name in entity.attributes):
+            self._store.publish(
+                entity_id, entity.state, state_delta.project(entity.attributes, projection)
+            )
 
-        if len(entity_settings.get("keys", {})) > 0:
-            # the entity is still attached to another key, so keep the trigger subscription
+        added = old_projection is not None and (projection is None or projection - old_projection)
+        if added and fetch_added:
+            self._schedule_entity_fetch(entity_id)
+
+    def get_entity_attributes(self, entity_id: str) -> Dict[str, Any]:
+        """
+        Get all attributes of an entity, including those no key needs, which are not cached. They
+        are fetched from Home Assistant, so this is meant for the configuration UI only.
+        """
+        return self._run_coroutine(self._get_entity_attributes(entity_id), {})
+
+    async def _get_entity_attributes(self, entity_id: str) -> Dict[str, Any]:
+        if not entity_id:
+            return {}
+        entity = self._store.get(entity_id)
+        if not entity:
+            return {}
+
+        compressed_state = (await self._fetch_entity_states({entity_id})).get(entity_id)
+        if compressed_state is None:
+            # not connected - the cached attributes are the best there is
+            return dict(entity.attributes)
+        return compressed_state.get(state_delta.COMPRESSED_ATTRIBUTES, {})
+
+    def _is_available(self) -> bool:
+        """
+        Return whether the cached entities are current enough to be shown: while connected, after
+        a warm start until the first connection attempt has failed, and during the offline grace
+        period after the connection was lost.
+        """
+        return self.is_connected() or self._warm_start or self._grace_period_handle is not None
+
+    def load_snapshot(self, path: str) -> None:
+        """
+        Fill the caches from the snapshot saved by the last session, so actions can show the last
+        known states until the connection is established. The caches are saved to the same path
+        while connected.
+        :param path: the path of the snapshot file
+        """
+        self._snapshot_path = path
+        snapshot = load_snapshot(path, self._get_instance(), self._codec)
+        if snapshot:
+            self._run_coroutine(self._apply_snapshot(snapshot))
+
+    async def _apply_snapshot(self, snapshot: Dict[str, Any]) -> None:
+        """Fill the caches from a snapshot unless live data has already been loaded."""
+        if self.is_connected() or not self._store.is_empty():
             return
 
-        message = self._create_message("unsubscribe_events")
-        message["subscription_id"] = entity_settings["subscription_id"]
-        self._changes_websocket.send(json.dumps(message))
-        entity_settings["subscription_id"] = -1
-        self._tracked_entities.pop(entity_id, None)
+        self._store.publish_all({
+            entity_id: (
+                self._pool.share(entity[const.STATE]),
+                self._pool.share_attributes(entity[const.ATTRIBUTES]),
+            )
+            for domain_entities in snapshot[FIELD_ENTITIES].values()
+            for entity_id, entity in domain_entities.items()
+        })
+        self._index.rebuild(self._store.get_all())
+        self._services = snapshot[FIELD_SERVICES]
+        self._warm_start = True
+        self._keys_show_unavailable = False
+        log.info("Loaded entities and services from snapshot")
+
+    def _end_warm_start(self) -> None:
+        """Stop showing the states from the snapshot because the connection attempt failed."""
+        if not self._warm_start:
+            return
+        self._warm_start = False
+        self._keys_show_unavailable = True
+        for action in self._registry.get_all_callbacks():
+            self._dispatch(action)
+
+    def _schedule_snapshot(self) -> None:
+        """Save the caches shortly, combining all changes within the delay into one write."""
+        if not self._snapshot_path or self._snapshot_handle:
+            return
+
+        def save():
+            self._snapshot_handle = None
+            if not self.is_connected():
+                return
+            snapshot = create_snapshot(
+                self._get_instance(), self._index.get_domains(), self._store.get_all(),
+                self._services
+            )
+            # only encoding happens on the event loop; the file is written in the background
+            self._loop.run_in_executor(
+                None, save_snapshot, self._snapshot_path, self._codec.dumps(snapshot)
+            )
+
+        self._snapshot_handle = self._loop.call_later(SNAPSHOT_DELAY, save)
+
+    def _get_instance(self) -> str:
+        """Return an identifier of the configured Home Assistant instance."""
+        return f"{self._host}:{self._port}"
 
     def is_connected(self) -> bool:
         """Return whether a connection to Home Assistant is established."""
-        return self._websocket is not None and self._websocket.connected
-
-    def _send_and_wait_for_response_with_semaphore(
-        self, message: Dict[str, Any], try_count: int = 0
-    ) -> str:
-        """Send a websocket message to Home Assistant and return the response using a semaphore."""
-        with self._websocket_semaphore:
-            return self._send_and_wait_for_response(message, try_count)
-
-    def _send_and_wait_for_response(
-        self, message: Dict[str, Any], try_count: int
-    ) -> str:
-        """Send a websocket message to Home Assistant and return the response."""
-        self._message_id += 1
-        message[ID] = self._message_id
+        return (
+            self._websocket is not None
+            and self._websocket.state is State.OPEN
+            and not self._waiting_for_start
+        )
 
+    async def _send(self, websocket: Optional[ClientConnection], message: Dict[str, Any]) -> bool:
+        """Send a websocket message to Home Assistant without waiting for a response."""
+        if not websocket:
+            log.error(f"Cannot send message {message}: not connected")
+            return False
         try:
-            self._websocket.send(json.dumps(message))
+            await websocket.send(self._codec.dumps(message))
         except ERRORS_TO_EXCEPT as e:
-            connected = self.reconnect()
-            if connected:
-                self._websocket.send(json.dumps(message))
-            else:
-                log.error(f"({e}) Cannot send message {message}")
-                return const.EMPTY_STRING
+            # the receive loop notices the lost connection as well and starts reconnecting
+            log.error(f"({e}) Cannot send message {message}")
+            return False
+        return True
+
+    async def _subscribe(
+        self, message: Dict[str, Any], handler: Callable[[Envelope], None]
+    ) -> int:
+        """
+        Send a subscription message to Home Assistant and route all events for the
+        subscription to the handler.
+        :return: the subscription id, -1 if the message could not be sent
+        """
+        subscription_id = message[ID]
+        self._event_handlers[subscription_id] = handler
+        if not await self._send(self._changes_websocket, message):
+            self._event_handlers.pop(subscription_id, None)
+            return -1
+        return subscription_id
+
+    async def _unsubscribe(self, subscription_id: int) -> None:
+        """Cancel a subscription and stop routing its events."""
+        self._event_handlers.pop(subscription_id, None)
+        message = self._create_message("unsubscribe_events")
+        message["subscription_id"] = subscription_id
+        await self._send(self._changes_websocket, message)
+
+    async def _send_and_wait_for_response(
+        self, message: Dict[str, Any], timeout: float = REQUEST_TIMEOUT,
+        websocket: Optional[ClientConnection] = None
+    ) -> Envelope:
+        """
+        Send a websocket message to Home Assistant and return the response. Any number of
+        messages may be waiting for their responses at the same time.
+        :param timeout: the time in seconds to wait for the response
+        :param websocket: the connection to send the message on; the command connection if None
+        :return: the response, NO_RESPONSE if the message was sent but the connection was lost,
+        TIMED_OUT if the response didn't arrive in time, NOT_SENT if the message could not be
+        sent at all
+        """
+        self._message_id += 1
+        message[ID] = self._message_id
+
+        response = self._correlator.register(message[ID])
+        if not await self._send(websocket or self._websocket, message):
+            self._correlator.discard(message[ID])
+            return NOT_SENT
+
         try:
-            return self._websocket.recv()
-        except ERRORS_TO_EXCEPT as e:
-            log.error(f"Error: {e}")
-            self.reconnect()
-            if try_count < 3:
-                return self._send_and_wait_for_response(message, try_count + 1)
-        log.error(f"Cannot send message {message}")
-        return const.EMPTY_STRING
-
-    def _keep_alive(self):
-        """Periodically ping the Home Assistant server to keep the websocket connection alive."""
+            return await asyncio.wait_for(response, timeout)
+        except asyncio.TimeoutError:
+            # a late response is dropped by the correlator
+            self._correlator.discard(message[ID])
+            self._request_timeouts += 1
+            log.error(f"No response within {timeout} seconds for message {message}")
+            return TIMED_OUT
+        except ConnectionError as e:
+            log.error(f"({e}) No response for message {message}")
+            return NO_RESPONSE
+
+    async def _keep_alive(self) -> None:
+        """
+        Periodically send Home Assistant's ping command on all connections to measure the
+        round-trip time and to detect connections that are dead without being closed, e.g. after a
+        network outage.
+        """
+        self._missed_pongs = 0
         while True:
-            sleep(PING_INTERVAL)
+            await asyncio.sleep(PING_INTERVAL)
             if not self._websocket:
                 return
-            try:
-                self._websocket.ping()
-            except ERRORS_TO_EXCEPT as e:
-                self._connection_status_callback(const.NOT_CONNECTED)
-                log.info(f"Disconnected from Home Assistant: {e}")
+
+            # with two connections, the event connection can die while commands still work
+            websockets = {self._websocket, self._changes_websocket} - {None}
+            start = monotonic()
+            responses = await asyncio.gather(*(
+                self._send_and_wait_for_response(
+                    self._create_message("ping"), PING_INTERVAL, websocket
+                )
+                for websocket in websockets
+            ))
+            if any(response is NOT_SENT or response is NO_RESPONSE for response in responses):
+                # the receive loop handles the lost connection
                 return
+            if not any(response is TIMED_OUT for response in responses):
+                self._rtt.record(monotonic() - start)
+                self._missed_pongs = 0
+                continue
 
-    def _retry_connect(self):
-        """Periodically try to connect to the Home Assistant server."""
+            self._missed_pongs += 1
+            if self._missed_pongs >= self._max_missed_pongs:
+                log.info(f"No pong from Home Assistant {self._missed_pongs} times - reconnecting")
+                await self._handle_connection_lost()
+                return
+
+    def _schedule_retry(self) -> None:
+        """Start trying to reconnect unless this is already happening."""
+        if not self._reconnect_task or self._reconnect_task.done():
+            self._reconnect_task = self._loop.create_task(self._retry_connect())
+
+    async def _retry_connect(self) -> None:
+        """Try to connect to the Home Assistant server with increasing delays between attempts."""
         log.info("Trying to reconnect to Home Assistant")
-        while not self._connect():
+        while not await self._connect():
+            if self._waiting_for_start:
+                # the homeassistant_started event completes the connection
+                return
             self._connection_status_callback(const.WAITING_FOR_RETRY)
-            sleep(10)
+            await self._wait_for_retry(self._backoff.next_delay())
+
+    async def _wait_for_retry(self, delay: float) -> None:
+        """
+        Wait before the next connection attempt. The wait ends early when the network changes or
+        when Home Assistant becomes reachable again.
+        """
+        self._retry_wakeup.clear()
+        deadline = self._loop.time() + delay
+        reachable = await self._probe()
+
+        while True:
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(self._retry_wakeup.wait(), min(remaining, PROBE_INTERVAL))
+                return
+            except asyncio.TimeoutError:
+                pass
+
+            was_reachable = reachable
+            reachable = await self._probe()
+            if reachable and not was_reachable:
+                log.info("Home Assistant is reachable again")
+                return
+
+    async def _probe(self) -> bool:
+        """Check whether the Home Assistant server accepts connections."""
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(self._host, int(self._port)), PROBE_INTERVAL
+            )
+        except ERRORS_TO_EXCEPT:
+            return False
+        writer.close()
+        return True
+
+    def notify_network_changed(self, available: bool) -> None:
+        """
+        Inform the backend that the network configuration has changed, so a pending connection
+        attempt is made immediately instead of after the current delay.
+        """
+        if available:
+            self._loop.call_soon_threadsafe(self._wake_up_retry)
+
+    def _wake_up_retry(self) -> None:
+        """Make the next connection attempt immediately."""
+        self._backoff.reset()
+        self._retry_wakeup.set()
 
     def register_action(self, action: Callable) -> None:
         """Register an action to be called when a connection to Home Assistant has been established."""
@@ -559,6 +1477,43 @@ class HomeAssistantBackend:
         if action in self._pending_actions:
             self._pending_actions.remove(action)
 
+    def get_stats(self) -> Dict[str, Any]:
+        """Return runtime statistics about the connection to Home Assistant."""
+        return {
+            "dispatch_queue_depth": self._dispatcher.get_depth(),
+            "dispatch_queue_max_depth": self._dispatcher.get_max_depth(),
+            "dispatched_callbacks": self._dispatcher.get_dispatched_count(),
+            "coalesced_callbacks": self._dispatcher.get_coalesced_count(),
+            "pending_updates": self._coalescer.get_pending_count(),
+            "pending_requests": self._correlator.get_pending_count(),
+            "request_timeouts": self._request_timeouts,
+            "frames_received": self._frames_received,
+            "messages_received": self._messages_received,
+            "missed_pongs": self._missed_pongs,
+            "heartbeat_rtt": self._rtt.get_summary(),
+            "compression": self._compression,
+            "transfer": self._transfer.get_stats(),
+            "command_timeouts": self._command_timeouts,
+            "subscriptions": self._registry.get_stats(),
+        }
+
+    def get_memory_report(self) -> Dict[str, Any]:
+        """Return the number of cached entities and attributes and the memory used by the caches."""
+        return self._run_coroutine(self._get_memory_report(), {})
+
+    async def _get_memory_report(self) -> Dict[str, Any]:
+        # runs on the event loop, so the caches don't change while they are measured
+        seen = set()
+        records = [entity for domain_entities in self._store.get_all().values()
+                   for entity in domain_entities.values()]
+        return {
+            "entities": len(records),
+            "attributes": sum(len(entity.attributes) for entity in records),
+            "pooled_values": self._pool.get_size(),
+            "entity_cache_bytes": get_deep_size(self._store.get_all(), seen),
+            "service_cache_bytes": get_deep_size(self._services, seen),
+        }
+
     def create_url(self, resource: str) -> Optional[str]:
         """Creates the URL for a specific resource on the HA host."""
         if not self._host or not resource:
@@ -571,13 +1526,7 @@ class HomeAssistantBackend:
         return f"{schema}{host}:{self._port}/{resource}"
 
 
-def _get_field_from_message(message: str, field: str) -> Any:
-    """Extracts the specified field from the message."""
-    if not message:
-        return ""
-    try:
-        parsed = json.loads(message)
-        return parsed.get(field, "")
-    except json.JSONDecodeError:
-        log.error(f"Could not parse {message}")
-        return ""
\ No newline at end of file
+def _is_running(config: Envelope) -> bool:
+    """Return whether the get_config response reports that Home Assistant is running."""
+    result = config.get_result()
+    return isinstance(result, dict) and result.get("state", "") == "RUNNING"
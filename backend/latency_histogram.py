@@ -0,0 +1,79 @@
+"""
+Module to collect round-trip times of the connection to Home Assistant.
+"""
+
+from bisect import bisect_left
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+
+class LatencyHistogram:
+    """
+    Keeps the most recent latency samples and summarizes them as a histogram.
+    :param bucket_bounds: the upper bounds of the buckets in seconds, in ascending order; samples
+    above the last bound are counted in an additional overflow bucket
+    :param window: the number of most recent samples the histogram is built from
+    """
+
+    def __init__(self, bucket_bounds: List[float], window: int):
+        self._bucket_bounds: List[float] = bucket_bounds
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, latency: float) -> None:
+        """
+        Add a sample; the oldest sample is dropped once the window is full.
+        :param latency: the latency in seconds
+        """
+        self._samples.append(latency)
+
+    def get_count(self) -> int:
+        """
+        Get the number of samples in the window.
+        :return: the number of samples in the window
+        """
+        return len(self._samples)
+
+    def get_last(self) -> Optional[float]:
+        """
+        Get the most recent sample.
+        :return: the most recent latency in seconds or None if there are no samples
+        """
+        return self._samples[-1] if self._samples else None
+
+    def get_percentile(self, percentile: float) -> Optional[float]:
+        """
+        Get a percentile of the samples in the window.
+        :param percentile: the percentile between 0 and 100
+        :return: the latency in seconds or None if there are no samples
+        """
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+        return samples[index]
+
+    def get_buckets(self) -> Dict[str, int]:
+        """
+        Get the number of samples per bucket.
+        :return: the number of samples keyed by the upper bound of the bucket
+        """
+        counts = [0] * (len(self._bucket_bounds) + 1)
+        for sample in self._samples:
+            counts[bisect_left(self._bucket_bounds, sample)] += 1
+
+        buckets = {f"<={bound}": count for bound, count in zip(self._bucket_bounds, counts)}
+        buckets[f">{self._bucket_bounds[-1]}"] = counts[-1]
+        return buckets
+
+    def get_summary(self) -> Dict[str, object]:
+        """
+        Get an overview of the samples in the window.
+        :return: count, last value, median, 95th percentile and buckets
+        """
+        return {
+            "count": self.get_count(),
+            "last": self.get_last(),
+            "p50": self.get_percentile(50),
+            "p95": self.get_percentile(95),
+            "buckets": self.get_buckets(),
+        }
@@ -0,0 +1,67 @@
+"""
+Module to correlate Home Assistant websocket responses with their requests.
+"""
+
+import asyncio
+from typing import Dict, Any
+
+
+class RequestCorrelator:
+    """
+    Keeps track of all requests waiting for a response and routes every response to the request
+    with the same message id. This allows many requests to be in flight on one websocket at once.
+    Must only be used from within the event loop.
+    """
+
+    def __init__(self):
+        self._pending: Dict[int, asyncio.Future] = {}
+
+    def register(self, message_id: int) -> asyncio.Future:
+        """
+        Register a request that is about to be sent.
+        :param message_id: the id of the request message
+        :return: the future that receives the response
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+        return future
+
+    def resolve(self, message_id: int, response: Any) -> bool:
+        """
+        Hand a response to the request with the same message id.
+        :param message_id: the id of the response message
+        :param response: the response
+        :return: whether a request was waiting for the response
+        """
+        future = self._pending.pop(message_id, None)
+        if future is None or future.done():
+            return False
+        future.set_result(response)
+        return True
+
+    def discard(self, message_id: int) -> None:
+        """
+        Stop waiting for the response to a request.
+        :param message_id: the id of the request message
+        """
+        future = self._pending.pop(message_id, None)
+        if future is not None and not future.done():
+            future.cancel()
+
+    def fail_all(self, exception: Exception) -> None:
+        """
+        Fail all pending requests, e.g. because the connection was lost.
+        :param exception: the exception to raise in all waiting requests
+        """
+        pending = self._pending
+        self._pending = {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(exception)
+
+    def get_pending_count(self) -> int:
+        """
+        Get the number of requests waiting for a response.
+        :return: the number of requests waiting for a response
+        """
+        return len(self._pending)
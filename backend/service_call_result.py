@@ -0,0 +1,59 @@
+"""
+Module for the result of a Home Assistant service call.
+"""
+
+from typing import Optional
+
+
+class ServiceCallResult:
+    """
+    The outcome of a service call.
+    :param entity_id: the entity the service was called for
+    :param service: the service that was called
+    :param success: whether Home Assistant executed the service successfully
+    :param latency: the time in seconds from sending the call until the response arrived
+    :param error: a description of the error if the call failed
+    """
+
+    def __init__(self, entity_id: str, service: str, success: bool, latency: float,
+                 error: Optional[str] = None):
+        self.entity_id: str = entity_id
+        self.service: str = service
+        self.success: bool = success
+        self.latency: float = latency
+        self.error: Optional[str] = error
+
+    def get_entity_id(self) -> str:
+        """
+        Get the entity the service was called for.
+        :return: the entity the service was called for
+        """
+        return self.entity_id
+
+    def get_service(self) -> str:
+        """
+        Get the service that was called.
+        :return: the service that was called
+        """
+        return self.service
+
+    def is_success(self) -> bool:
+        """
+        Get whether Home Assistant executed the service successfully.
+        :return: whether Home Assistant executed the service successfully
+        """
+        return self.success
+
+    def get_latency(self) -> float:
+        """
+        Get the time in seconds from sending the call until the response arrived.
+        :return: the latency in seconds
+        """
+        return self.latency
+
+    def get_error(self) -> Optional[str]:
+        """
+        Get a description of the error if the call failed.
+        :return: the error description or None
+        """
+        return self.error
@@ -0,0 +1,92 @@
+"""
+Module to persist the entity and service caches between plugin starts.
+"""
+
+import os
+from typing import Any, Dict, Optional
+
+from loguru import logger as log
+
+from de_gensyn_HomeAssistantPlugin import const
+from de_gensyn_HomeAssistantPlugin.backend.codec import Codec
+from de_gensyn_HomeAssistantPlugin.backend.entity_store import EntityRecord
+
+# increase whenever the format changes; snapshots with another version are ignored
+SNAPSHOT_VERSION = 1
+
+FIELD_VERSION = "version"
+FIELD_INSTANCE = "instance"
+FIELD_DOMAINS = "domains"
+FIELD_ENTITIES = "entities"
+FIELD_SERVICES = "services"
+
+
+def create_snapshot(instance: str, domains: list, entities: Dict[str, Dict[str, EntityRecord]],
+                    services: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Create a snapshot of the caches. The actions tracking the entities are not part of it.
+    :param instance: identifies the Home Assistant instance the caches belong to
+    :param domains: the domain cache
+    :param entities: the entity cache
+    :param services: the service cache
+    :return: the snapshot
+    """
+    return {
+        FIELD_VERSION: SNAPSHOT_VERSION,
+        FIELD_INSTANCE: instance,
+        FIELD_DOMAINS: list(domains),
+        FIELD_ENTITIES: {
+            domain: {
+                entity_id: {
+                    const.STATE: entity.state,
+                    const.ATTRIBUTES: entity.attributes,
+                }
+                for entity_id, entity in domain_entities.items()
+            }
+            for domain, domain_entities in entities.items()
+        },
+        FIELD_SERVICES: services,
+    }
+
+
+def save_snapshot(path: str, data: str) -> None:
+    """
+    Write an encoded snapshot to the disk. The file is replaced atomically, so a crash while
+    writing never leaves a broken snapshot behind.
+    :param path: the path of the snapshot file
+    :param data: the encoded snapshot
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+    except OSError as e:
+        log.error(f"Could not save snapshot {path}: {e}")
+
+
+def load_snapshot(path: str, instance: str, codec: Codec) -> Optional[Dict[str, Any]]:
+    """
+    Read a snapshot from the disk.
+    :param path: the path of the snapshot file
+    :param instance: identifies the Home Assistant instance the caches must belong to
+    :param codec: the codec to decode the snapshot with
+    :return: the snapshot or None if there is no usable snapshot
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            snapshot = codec.loads(file.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        log.error(f"Could not load snapshot {path}: {e}")
+        return None
+
+    if not isinstance(snapshot, dict) or snapshot.get(FIELD_VERSION) != SNAPSHOT_VERSION:
+        log.info(f"Ignoring snapshot {path} with unknown version")
+        return None
+    if snapshot.get(FIELD_INSTANCE) != instance:
+        # the snapshot belongs to another Home Assistant instance
+        return None
+    return snapshot
@@ -0,0 +1,142 @@
+"""
+Module to apply the compressed states sent by Home Assistant's subscribe_entities command to the
+entity cache.
+"""
+
+from typing import Dict, Any, Set, Optional, Container, Tuple
+
+from de_gensyn_HomeAssistantPlugin import const
+from de_gensyn_HomeAssistantPlugin.backend.entity_store import EntityRecord, ValuePool
+
+ENTITIES_ADDED = "a"
+ENTITIES_CHANGED = "c"
+ENTITIES_REMOVED = "r"
+DIFF_ADDITIONS = "+"
+DIFF_REMOVALS = "-"
+COMPRESSED_STATE = "s"
+COMPRESSED_ATTRIBUTES = "a"
+
+_MISSING = object()
+
+
+def apply_compressed_state(entity: EntityRecord, compressed_state: Dict[str, Any],
+                           pool: ValuePool, projection: Optional[Container[str]] = None
+                           ) -> Tuple[Any, Dict[str, Any], Set[str]]:
+    """
+    Apply a complete compressed state to a cached entity. The record is not changed; changed
+    attributes are written to a copy.
+    :param entity: the cached entity
+    :param compressed_state: the compressed state as sent in the "a" part of an event
+    :param pool: the pool to share the new values with
+    :param projection: the attributes to keep; all attributes are kept if None
+    :return: the new state, the new attributes and the changed fields - "state" for the state and
+    the names of changed attributes
+    """
+    changed = set()
+
+    state = compressed_state.get(COMPRESSED_STATE)
+    if entity.state != state:
+        state = pool.share(state)
+        changed.add(const.STATE)
+    else:
+        state = entity.state
+
+    attributes = entity.attributes
+    new_attributes = project(compressed_state.get(COMPRESSED_ATTRIBUTES, {}), projection)
+
+    removed = [name for name in attributes if name not in new_attributes]
+    if removed:
+        attributes = {name: value for name, value in attributes.items()
+                      if name in new_attributes}
+        changed.update(removed)
+
+    attributes, changed_attributes = _set_attributes(attributes, new_attributes, pool,
+                                                     attributes is entity.attributes)
+    changed.update(changed_attributes)
+
+    return state, attributes, changed
+
+
+def apply_diff(entity: EntityRecord, diff: Dict[str, Any], pool: ValuePool,
+               projection: Optional[Container[str]] = None
+               ) -> Tuple[Any, Dict[str, Any], Set[str]]:
+    """
+    Apply a compressed state diff to a cached entity. The record is not changed; changed
+    attributes are written to a copy.
+    :param entity: the cached entity
+    :param diff: the diff as sent in the "c" part of an event
+    :param pool: the pool to share the new values with
+    :param projection: the attributes to keep; all attributes are kept if None
+    :return: the new state, the new attributes and the changed fields - "state" for the state and
+    the names of changed attributes
+    """
+    changed = set()
+    additions = diff.get(DIFF_ADDITIONS, {})
+    removals = diff.get(DIFF_REMOVALS, {})
+
+    state = additions.get(COMPRESSED_STATE, _MISSING)
+    if state is not _MISSING and entity.state != state:
+        state = pool.share(state)
+        changed.add(const.STATE)
+    else:
+        state = entity.state
+
+    attributes, changed_attributes = _set_attributes(
+        entity.attributes, project(additions.get(COMPRESSED_ATTRIBUTES, {}), projection), pool,
+        True
+    )
+    changed.update(changed_attributes)
+
+    removed = [name for name in removals.get(COMPRESSED_ATTRIBUTES, []) if name in attributes]
+    if removed:
+        attributes = {name: value for name, value in attributes.items() if name not in removed}
+        changed.update(removed)
+
+    return state, attributes, changed
+
+
+def get_changed_fields(entity: EntityRecord, state: Any, attributes: Dict[str, Any]) -> Set[str]:
+    """
+    Compare a cached entity with a complete new state.
+    :param entity: the cached entity
+    :param state: the new state
+    :param attributes: the new attributes
+    :return: the changed fields - "state" for the state and the names of changed attributes
+    """
+    changed = {name for name in entity.attributes.keys() | attributes.keys()
+               if entity.attributes.get(name, _MISSING) != attributes.get(name, _MISSING)}
+    if entity.state != state:
+        changed.add(const.STATE)
+    return changed
+
+
+def project(attributes: Dict[str, Any], projection: Optional[Container[str]]) -> Dict[str, Any]:
+    """
+    Get only the attributes that are part of a projection.
+    :param attributes: the attributes
+    :param projection: the attributes to keep; all attributes are kept if None
+    :return: the kept attributes
+    """
+    if projection is None:
+        return attributes
+    return {name: value for name, value in attributes.items() if name in projection}
+
+
+def _set_attributes(attributes: Dict[str, Any], new_attributes: Dict[str, Any], pool: ValuePool,
+                    copy: bool) -> Tuple[Dict[str, Any], Set[str]]:
+    """
+    Write all new attribute values that differ from the current ones.
+    :param copy: whether the attributes belong to a published record and must be copied before
+    writing to them
+    :return: the attributes and the names of the changed attributes
+    """
+    changed = set()
+    for name, value in new_attributes.items():
+        if attributes.get(name, _MISSING) != value:
+            if copy:
+                attributes = dict(attributes)
+                copy = False
+            name = pool.share(name)
+            attributes[name] = pool.share(value)
+            changed.add(name)
+    return attributes, changed
@@ -0,0 +1,143 @@
+"""
+Module for the registry of the keys showing Home Assistant entities.
+"""
+
+import weakref
+from inspect import ismethod
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+CallbackRef = Callable[[], Optional[Callable]]
+
+
+class SubscriptionRegistry:
+    """
+    Keeps track of which keys show which entities. An entity stays subscribed as long as at least
+    one key references it. Callbacks that are bound methods are only referenced weakly, so the
+    registry never keeps a deleted action alive.
+    :param on_collected: called with the entity id, the action uid and the reference when the
+    callback of a key was garbage collected; may be called on any thread
+    """
+
+    def __init__(self, on_collected: Callable[[str, str, CallbackRef], None]):
+        self._on_collected = on_collected
+        # the callback references of the keys, by entity id and action uid
+        self._keys: Dict[str, Dict[str, CallbackRef]] = {}
+        self._entity_ids: Dict[str, str] = {}
+
+    def add(self, entity_id: str, action_uid: str, callback: Callable) -> bool:
+        """
+        Register a key showing an entity. A key already showing another entity is moved.
+        :param entity_id: the id of the entity
+        :param action_uid: the uid of the action of the key
+        :param callback: called when the entity is updated
+        :return: whether the entity was not referenced by any key before
+        """
+        old_entity_id = self._entity_ids.get(action_uid)
+        if old_entity_id is not None and old_entity_id != entity_id:
+            self.remove(old_entity_id, action_uid)
+
+        keys = self._keys.setdefault(entity_id, {})
+        first = not keys
+        keys[action_uid] = self._create_ref(entity_id, action_uid, callback)
+        self._entity_ids[action_uid] = entity_id
+        return first
+
+    def remove(self, entity_id: str, action_uid: str) -> bool:
+        """
+        Deregister a key showing an entity.
+        :param entity_id: the id of the entity
+        :param action_uid: the uid of the action of the key
+        :return: whether the entity is no longer referenced by any key
+        """
+        keys = self._keys.get(entity_id)
+        if keys is None or keys.pop(action_uid, None) is None:
+            return False
+
+        del self._entity_ids[action_uid]
+        if keys:
+            return False
+        del self._keys[entity_id]
+        return True
+
+    def contains(self, entity_id: str, action_uid: str) -> bool:
+        """
+        Get whether a key is registered for an entity.
+        :return: whether the key is registered for the entity
+        """
+        return action_uid in self._keys.get(entity_id, {})
+
+    def is_current(self, entity_id: str, action_uid: str, ref: CallbackRef) -> bool:
+        """
+        Get whether a reference still belongs to the registered key, i.e. the key has been
+        neither removed nor registered again since.
+        :return: whether the reference is the current one of the key
+        """
+        return self._keys.get(entity_id, {}).get(action_uid) is ref
+
+    def get_entity_id(self, action_uid: str) -> Optional[str]:
+        """
+        Get the entity a key shows.
+        :param action_uid: the uid of the action of the key
+        :return: the id of the entity or None if the key is not registered
+        """
+        return self._entity_ids.get(action_uid)
+
+    def get_entity_ids(self) -> Set[str]:
+        """
+        Get all entities referenced by at least one key.
+        :return: the entity ids
+        """
+        return set(self._keys)
+
+    def get_ref_count(self, entity_id: str) -> int:
+        """
+        Get the number of keys showing an entity.
+        :param entity_id: the id of the entity
+        :return: the number of keys
+        """
+        return len(self._keys.get(entity_id, {}))
+
+    def get_callbacks(self, entity_id: str) -> List[Tuple[str, Callable]]:
+        """
+        Get the callbacks of the keys showing an entity. Keys whose action has been collected are
+        skipped.
+        :param entity_id: the id of the entity
+        :return: the action uids and callbacks
+        """
+        callbacks = []
+        for action_uid, ref in self._keys.get(entity_id, {}).items():
+            callback = ref()
+            if callback is not None:
+                callbacks.append((action_uid, callback))
+        return callbacks
+
+    def get_all_callbacks(self) -> List[Callable]:
+        """
+        Get the callbacks of all keys. Keys whose action has been collected are skipped.
+        :return: the callbacks
+        """
+        return [callback for entity_id in self._keys
+                for _, callback in self.get_callbacks(entity_id)]
+
+    def get_subscriptions(self) -> Dict[str, List[str]]:
+        """
+        Get the keys showing each entity.
+        :return: the action uids by entity id
+        """
+        return {entity_id: list(keys) for entity_id, keys in self._keys.items()}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get the number of referenced entities and registered keys.
+        :return: the statistics
+        """
+        return {"entities": len(self._keys), "keys": len(self._entity_ids)}
+
+    def _create_ref(self, entity_id: str, action_uid: str, callback: Callable) -> CallbackRef:
+        """Create the reference to the callback of a key."""
+        if ismethod(callback):
+            return weakref.WeakMethod(
+                callback, lambda ref: self._on_collected(entity_id, action_uid, ref)
+            )
+        # plain functions don't belong to an action, so they may be kept alive
+        return lambda: callback
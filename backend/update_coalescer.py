@@ -0,0 +1,99 @@
+"""
+Module to limit the rate at which entity updates are delivered to the actions.
+"""
+
+import asyncio
+from typing import Dict, Any, Callable, Tuple
+
+from de_gensyn_HomeAssistantPlugin import const
+
+
+class UpdateCoalescer:
+    """
+    Sits between the receive loop and the action callbacks. Every key receives at most
+    max_rate updates per second; updates arriving in between replace the pending update for the
+    key, so only the newest state is rendered. The changed fields of replaced updates are merged
+    into the pending update to not lose any of them. Must only be used from within the event loop.
+    :param loop: the event loop to schedule deliveries on
+    :param dispatch: called with the uid, the callback and the update state to deliver an update
+    :param max_rate: the maximum number of updates per second and key; 0 for no limit
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, dispatch: Callable, max_rate: float):
+        self._loop = loop
+        self._dispatch = dispatch
+        self._interval: float = 0
+        self._pending: Dict[str, Tuple[Callable, Dict[str, Any]]] = {}
+        self._last_delivery: Dict[str, float] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self.set_max_rate(max_rate)
+
+    def set_max_rate(self, max_rate: float) -> None:
+        """
+        Set the maximum number of updates per second and key.
+        :param max_rate: the maximum number of updates per second and key; 0 for no limit
+        """
+        self._interval = 1 / max_rate if max_rate > 0 else 0
+
+    def submit(self, uid: str, callback: Callable, update_state: Dict[str, Any]) -> None:
+        """
+        Deliver an update to a key now or as soon as the rate limit allows it.
+        :param uid: the uid of the key
+        :param callback: the callback of the key
+        :param update_state: the update to deliver
+        """
+        pending = self._pending.get(uid)
+        if pending:
+            # latest wins, but the fields changed by the replaced update are still changed
+            update_state = dict(update_state)
+            update_state[const.CHANGED_FIELDS] = (
+                pending[1][const.CHANGED_FIELDS] | update_state[const.CHANGED_FIELDS]
+            )
+        self._pending[uid] = (callback, update_state)
+
+        if uid in self._timers:
+            return
+
+        delay = self._last_delivery.get(uid, -self._interval) + self._interval - self._loop.time()
+        if delay <= 0:
+            self._deliver(uid)
+        else:
+            self._timers[uid] = self._loop.call_later(delay, self._deliver, uid)
+
+    def discard(self, uid: str) -> None:
+        """
+        Drop the pending update of a key, e.g. because its entity was removed.
+        :param uid: the uid of the key
+        """
+        self._pending.pop(uid, None)
+        self._last_delivery.pop(uid, None)
+        timer = self._timers.pop(uid, None)
+        if timer:
+            timer.cancel()
+
+    def flush(self) -> None:
+        """
+        Deliver all pending updates right away, e.g. because the connection was lost. The cache
+        already holds their states, so they would not be delivered again after reconnecting.
+        """
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers = {}
+        for uid in list(self._pending):
+            self._deliver(uid)
+
+    def get_pending_count(self) -> int:
+        """
+        Get the number of keys with an update waiting for delivery.
+        :return: the number of keys with an update waiting for delivery
+        """
+        return len(self._pending)
+
+    def _deliver(self, uid: str) -> None:
+        """Deliver the pending update of a key."""
+        self._timers.pop(uid, None)
+        pending = self._pending.pop(uid, None)
+        if not pending:
+            return
+        self._last_delivery[uid] = self._loop.time()
+        self._dispatch(uid, *pending)
@@ -12,12 +12,24 @@ LABEL_BASE_PORT = "actions.base.port.label"
 LABEL_BASE_SSL = "actions.base.ssl.label"
 LABEL_BASE_VERIFY_CERTIFICATE = "actions.base.verify_certificate.label"
 LABEL_BASE_TOKEN = "actions.base.token.label"
+LABEL_BASE_SINGLE_SOCKET = "actions.base.single_socket.label"
+LABEL_BASE_COMPRESSION = "actions.base.compression.label"
+LABEL_BASE_MAX_UPDATE_RATE = "actions.base.max_update_rate.label"
+LABEL_BASE_MAX_MISSED_PONGS = "actions.base.max_missed_pongs.label"
+LABEL_BASE_OFFLINE_GRACE_PERIOD = "actions.base.offline_grace_period.label"
+LABEL_BASE_SHOW_STALE = "actions.base.show_stale.label"
 
 SETTING_HOST = "host"
 SETTING_PORT = "port"
 SETTING_SSL = "ssl"
 SETTING_VERIFY_CERTIFICATE = "verify_certificate"
 SETTING_TOKEN = "token"
+SETTING_SINGLE_SOCKET = "single_socket"
+SETTING_COMPRESSION = "compression"
+SETTING_MAX_UPDATE_RATE = "max_update_rate"
+SETTING_MAX_MISSED_PONGS = "max_missed_pongs"
+SETTING_OFFLINE_GRACE_PERIOD = "offline_grace_period"
+SETTING_SHOW_STALE = "show_stale"
 
 # HOME_ASSISTANT_ACTION
 CONNECT_BIND = "bind"
@@ -31,11 +43,14 @@ CONNECT_LEAVE = "leave"
 CONNECT_NOTIFY_SELECTED = "notify::selected"
 CONNECT_NOTIFY_ACTIVE = "notify::active"
 CONNECT_NOTIFY_TEXT = "notify::text"
+CONNECT_NOTIFY_VALUE = "notify::value"
+CONNECT_NETWORK_CHANGED = "network-changed"
 CONNECT_NOTIFY_COLOR_SET = "color-set"
 CONNECT_NOTIFY_ENABLE_EXPANSION = "notify::enable-expansion"
 
 LABEL_ENTITY_DOMAIN = "actions.home_assistant.entity.domain.label"
 LABEL_ENTITY_ENTITY = "actions.home_assistant.entity.entity.label"
+LABEL_ENTITY_SEARCH = "actions.home_assistant.entity.search.label"
 
 LABEL_SERVICE_CALL_SERVICE = "actions.home_assistant.service.call_service.label"
 LABEL_SERVICE_SERVICE = "actions.home_assistant.service.service.label"
@@ -192,10 +207,18 @@ TEXT_POSITION_CENTER = "center"
 TEXT_POSITION_BOTTOM = "bottom"
 
 ICON_COLOR_RED = "#ff0000"
+ICON_COLOR_ORANGE = "#ffa500"
 
 ICON_NETWORK_OFF = "network-off"
+ICON_STALE = "clock-alert"
 
 MDI_SVG_JSON = "assets/mdi-svg.json"
+SNAPSHOT_FILE = "cache/snapshot.json"
+
+DEFAULT_MAX_UPDATE_RATE = 10
+DEFAULT_MAX_MISSED_PONGS = 3
+DEFAULT_OFFLINE_GRACE_PERIOD = 10
+DEFAULT_SHOW_STALE = False
 
 DEFAULT_SERVICE_CALL_SERVICE = False
 
@@ -235,5 +258,9 @@ DISCONNECTING = "Disconnecting"
 NOT_CONNECTED = "Not connected"
 AUTHENTICATING = "Authenticating"
 WAITING_FOR_RETRY = "Waiting for retry"
+WAITING_FOR_START = "Waiting for Home Assistant to start"
 
 HA_CONNECTED = "connected"
+HA_STALE = "stale"
+CHANGED_FIELDS = "changed_fields"
+VERSION = "version"
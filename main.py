@@ -1,6 +1,7 @@
 """
 Entry point for StreamController to load the plugin.
 """
+import os
 import sys
 from pathlib import Path
 from typing import Dict, Any
@@ -8,8 +9,8 @@ from typing import Dict, Any
 import gi
 
 gi.require_version("Adw", "1")
-from gi.repository import GLib
-from gi.repository.Adw import EntryRow, SwitchRow, PasswordEntryRow, PreferencesGroup
+from gi.repository import GLib, Gio
+from gi.repository.Adw import EntryRow, SwitchRow, SpinRow, PasswordEntryRow, PreferencesGroup
 
 ABSOLUTE_PLUGIN_PATH = str(Path(__file__).parent.parent.absolute())
 sys.path.insert(0, ABSOLUTE_PLUGIN_PATH)
@@ -24,6 +25,17 @@ from de_gensyn_HomeAssistantPlugin.actions.HomeAssistantAction.home_assistant_ac
     HomeAssistantAction
 from de_gensyn_HomeAssistantPlugin.backend.home_assistant import HomeAssistantBackend
 
+# settings that only take effect with a new connection; all others are applied immediately
+CONNECTION_SETTINGS = frozenset({
+    const.SETTING_HOST,
+    const.SETTING_PORT,
+    const.SETTING_SSL,
+    const.SETTING_VERIFY_CERTIFICATE,
+    const.SETTING_TOKEN,
+    const.SETTING_SINGLE_SOCKET,
+    const.SETTING_COMPRESSION,
+})
+
 
 class HomeAssistantDeprecated(PluginBase):  # pylint: disable=too-few-public-methods
     """The plugin class to be loaded by Stream Controller. Manages the credentials."""
@@ -32,6 +44,12 @@ class HomeAssistantDeprecated(PluginBase):  # pylint: disable=too-few-public-met
     ssl_switch: SwitchRow
     verify_certificate_switch: SwitchRow
     token_entry: PasswordEntryRow
+    single_socket_switch: SwitchRow
+    compression_switch: SwitchRow
+    max_update_rate_spin: SpinRow
+    max_missed_pongs_spin: SpinRow
+    offline_grace_period_spin: SpinRow
+    show_stale_switch: SwitchRow
     connection_status: EntryRow
 
     def __init__(self):
@@ -58,6 +76,15 @@ class HomeAssistantDeprecated(PluginBase):  # pylint: disable=too-few-public-met
         ssl = self.settings.get(const.SETTING_SSL, True)
         verify_certificate = self.settings.get(const.SETTING_VERIFY_CERTIFICATE, True)
         token = self.settings.get(const.SETTING_TOKEN, const.EMPTY_STRING)
+        single_socket = self.settings.get(const.SETTING_SINGLE_SOCKET, False)
+        compression = self.settings.get(const.SETTING_COMPRESSION, True)
+        max_update_rate = self.settings.get(const.SETTING_MAX_UPDATE_RATE,
+                                            const.DEFAULT_MAX_UPDATE_RATE)
+        max_missed_pongs = self.settings.get(const.SETTING_MAX_MISSED_PONGS,
+                                             const.DEFAULT_MAX_MISSED_PONGS)
+        offline_grace_period = self.settings.get(const.SETTING_OFFLINE_GRACE_PERIOD,
+                                                 const.DEFAULT_OFFLINE_GRACE_PERIOD)
+        show_stale = self.settings.get(const.SETTING_SHOW_STALE, const.DEFAULT_SHOW_STALE)
 
         self.backend = HomeAssistantBackend()
         self.backend.set_host(host)
@@ -65,10 +92,22 @@ class HomeAssistantDeprecated(PluginBase):  # pylint: disable=too-few-public-met
         self.backend.set_ssl(ssl)
         self.backend.set_verify_certificate(verify_certificate)
         self.backend.set_token(token)
-        self.backend.reconnect()
+        self.backend.set_single_socket(single_socket)
+        self.backend.set_compression(compression)
+        self.backend.set_max_update_rate(max_update_rate)
+        self.backend.set_max_missed_pongs(max_missed_pongs)
+        self.backend.set_offline_grace_period(offline_grace_period)
+        self.backend.set_show_stale(show_stale)
+        # show the last known states immediately and connect in the background
+        self.backend.load_snapshot(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                const.SNAPSHOT_FILE))
+        self.backend.reconnect_async()
+
+        Gio.NetworkMonitor.get_default().connect(const.CONNECT_NETWORK_CHANGED,
+                                                 self._on_network_changed)
 
-    def set_settings(self, settings: Dict[str, Any]):
-        """Saves the settings to the disk."""
+    def set_settings(self, settings: Dict[str, Any], reconnect: bool = True):
+        """Saves the settings to the disk and reconnects if requested."""
         super().set_settings(settings)
 
         host = settings.get(const.SETTING_HOST, const.EMPTY_STRING)
@@ -76,13 +115,28 @@ class HomeAssistantDeprecated(PluginBase):  # pylint: disable=too-few-public-met
         ssl = settings.get(const.SETTING_SSL, True)
         verify_certificate = settings.get(const.SETTING_VERIFY_CERTIFICATE, True)
         token = settings.get(const.SETTING_TOKEN, const.EMPTY_STRING)
+        single_socket = settings.get(const.SETTING_SINGLE_SOCKET, False)
+        compression = settings.get(const.SETTING_COMPRESSION, True)
+        max_update_rate = settings.get(const.SETTING_MAX_UPDATE_RATE, const.DEFAULT_MAX_UPDATE_RATE)
+        max_missed_pongs = settings.get(const.SETTING_MAX_MISSED_PONGS,
+                                        const.DEFAULT_MAX_MISSED_PONGS)
+        offline_grace_period = settings.get(const.SETTING_OFFLINE_GRACE_PERIOD,
+                                            const.DEFAULT_OFFLINE_GRACE_PERIOD)
+        show_stale = settings.get(const.SETTING_SHOW_STALE, const.DEFAULT_SHOW_STALE)
 
         self.backend.set_host(host)
         self.backend.set_port(port)
         self.backend.set_ssl(ssl)
         self.backend.set_verify_certificate(verify_certificate)
         self.backend.set_token(token)
-        self.backend.reconnect()
+        self.backend.set_single_socket(single_socket)
+        self.backend.set_compression(compression)
+        self.backend.set_max_update_rate(max_update_rate)
+        self.backend.set_max_missed_pongs(max_missed_pongs)
+        self.backend.set_offline_grace_period(offline_grace_period)
+        self.backend.set_show_stale(show_stale)
+        if reconnect:
+            self.backend.reconnect_async()
 
     def get_settings_area(self):
         """Gets the rows for configuring Home Assistant credentials and base settings."""
@@ -92,6 +146,20 @@ class HomeAssistantDeprecated(PluginBase):  # pylint: disable=too-few-public-met
         self.verify_certificate_switch = SwitchRow(
             title=self.locale_manager.get(const.LABEL_BASE_VERIFY_CERTIFICATE))
         self.token_entry = PasswordEntryRow(title=self.locale_manager.get(const.LABEL_BASE_TOKEN))
+        self.single_socket_switch = SwitchRow(
+            title=self.locale_manager.get(const.LABEL_BASE_SINGLE_SOCKET))
+        self.compression_switch = SwitchRow(
+            title=self.locale_manager.get(const.LABEL_BASE_COMPRESSION))
+        self.max_update_rate_spin = SpinRow.new_with_range(1, 60, 1)
+        self.max_update_rate_spin.set_title(
+            self.locale_manager.get(const.LABEL_BASE_MAX_UPDATE_RATE))
+        self.max_missed_pongs_spin = SpinRow.new_with_range(1, 10, 1)
+        self.max_missed_pongs_spin.set_title(
+            self.locale_manager.get(const.LABEL_BASE_MAX_MISSED_PONGS))
+        self.offline_grace_period_spin = SpinRow.new_with_range(0, 300, 1)
+        self.offline_grace_period_spin.set_title(
+            self.locale_manager.get(const.LABEL_BASE_OFFLINE_GRACE_PERIOD))
+        self.show_stale_switch = SwitchRow(title=self.locale_manager.get(const.LABEL_BASE_SHOW_STALE))
 
         self.connection_status = EntryRow(title="Connection status:")
         self.connection_status.set_editable(False)
@@ -113,6 +181,19 @@ class HomeAssistantDeprecated(PluginBase):  # pylint: disable=too-few-public-met
                                                const.SETTING_VERIFY_CERTIFICATE)
         self.token_entry.connect(const.CONNECT_NOTIFY_TEXT, self._on_change_base_entry,
                                  const.SETTING_TOKEN)
+        self.single_socket_switch.connect(const.CONNECT_NOTIFY_ACTIVE, self._on_change_base_switch,
+                                          const.SETTING_SINGLE_SOCKET)
+        self.compression_switch.connect(const.CONNECT_NOTIFY_ACTIVE, self._on_change_base_switch,
+                                        const.SETTING_COMPRESSION)
+        self.max_update_rate_spin.connect(const.CONNECT_NOTIFY_VALUE, self._on_change_base_spin,
+                                          const.SETTING_MAX_UPDATE_RATE)
+        self.max_missed_pongs_spin.connect(const.CONNECT_NOTIFY_VALUE, self._on_change_base_spin,
+                                           const.SETTING_MAX_MISSED_PONGS)
+        self.offline_grace_period_spin.connect(const.CONNECT_NOTIFY_VALUE,
+                                               self._on_change_base_spin,
+                                               const.SETTING_OFFLINE_GRACE_PERIOD)
+        self.show_stale_switch.connect(const.CONNECT_NOTIFY_ACTIVE, self._on_change_base_switch,
+                                       const.SETTING_SHOW_STALE)
 
         group = PreferencesGroup()
         group.add(self.host_entry)
@@ -120,6 +201,12 @@ class HomeAssistantDeprecated(PluginBase):  # pylint: disable=too-few-public-met
         group.add(self.ssl_switch)
         group.add(self.verify_certificate_switch)
         group.add(self.token_entry)
+        group.add(self.single_socket_switch)
+        group.add(self.compression_switch)
+        group.add(self.max_update_rate_spin)
+        group.add(self.max_missed_pongs_spin)
+        group.add(self.offline_grace_period_spin)
+        group.add(self.show_stale_switch)
         group.add(self.connection_status)
 
         return group
@@ -131,11 +218,21 @@ class HomeAssistantDeprecated(PluginBase):  # pylint: disable=too-few-public-met
         self.ssl_switch.set_active(self.settings[const.SETTING_SSL])
         self.verify_certificate_switch.set_active(self.settings[const.SETTING_VERIFY_CERTIFICATE])
         self.token_entry.set_text(self.settings[const.SETTING_TOKEN])
+        self.single_socket_switch.set_active(self.settings[const.SETTING_SINGLE_SOCKET])
+        self.compression_switch.set_active(self.settings[const.SETTING_COMPRESSION])
+        self.max_update_rate_spin.set_value(self.settings[const.SETTING_MAX_UPDATE_RATE])
+        self.max_missed_pongs_spin.set_value(self.settings[const.SETTING_MAX_MISSED_PONGS])
+        self.offline_grace_period_spin.set_value(self.settings[const.SETTING_OFFLINE_GRACE_PERIOD])
+        self.show_stale_switch.set_active(self.settings[const.SETTING_SHOW_STALE])
 
     def _on_change_base_entry(self, entry, *args) -> None:
         """Executed when an entry row is changed."""
         self.set_setting(args[1], entry.get_text())
 
+    def _on_change_base_spin(self, spin, *args) -> None:
+        """Executed when a spin row is changed."""
+        self.set_setting(args[1], int(spin.get_value()))
+
     def _on_change_base_switch(self, switch, *args) -> None:
         """Executed when a switch row is changed."""
         self.set_setting(args[1], switch.get_active())
@@ -147,6 +244,10 @@ class HomeAssistantDeprecated(PluginBase):  # pylint: disable=too-few-public-met
             self.verify_certificate_switch.set_sensitive(False)
             self.verify_certificate_switch.set_active(False)
 
+    def _on_network_changed(self, _, network_available: bool) -> None:
+        """Executed when the network configuration changes."""
+        self.backend.notify_network_changed(network_available)
+
     def set_status(self, status) -> None:
         """Callback function to be executed when the Home Assistant connection status changes."""
         GLib.idle_add(self.connection_status.set_text, status)
@@ -154,4 +255,4 @@ class HomeAssistantDeprecated(PluginBase):  # pylint: disable=too-few-public-met
     def set_setting(self, key, value) -> None:
         """Sets the setting in the local copy and also writes it to the disk."""
         self.settings[key] = value
-        self.set_settings(self.settings)
+        self.set_settings(self.settings, key in CONNECTION_SETTINGS)
@@ -0,0 +1,44 @@
+import sys
+import unittest
+from pathlib import Path
+
+absolute_plugin_path = str(Path(__file__).parent.parent.parent.absolute())
+
+sys.path.insert(0, absolute_plugin_path)
+
+from de_gensyn_HomeAssistantPlugin.backend.backoff import Backoff
+
+
+class TestBackoff(unittest.TestCase):
+
+    def test_delays_grow_up_to_maximum(self):
+        backoff = Backoff(1, 10, 2, 0)
+
+        self.assertEqual([1, 2, 4, 8, 10, 10], [backoff.next_delay() for _ in range(6)])
+
+    def test_reset(self):
+        backoff = Backoff(1, 10, 2, 0)
+        for _ in range(10):
+            backoff.next_delay()
+
+        backoff.reset()
+
+        self.assertEqual([1, 2], [backoff.next_delay() for _ in range(2)])
+
+    def test_jitter(self):
+        for _ in range(100):
+            backoff = Backoff(1, 10, 2, 0.25)
+            delays = [backoff.next_delay() for _ in range(6)]
+
+            for delay, expected in zip(delays, [1, 2, 4, 8, 10, 10]):
+                self.assertGreaterEqual(delay, expected * 0.75)
+                self.assertLessEqual(delay, expected * 1.25)
+
+    def test_jitter_spreads_delays(self):
+        delays = {Backoff(1, 10, 2, 0.25).next_delay() for _ in range(20)}
+
+        self.assertGreater(len(delays), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
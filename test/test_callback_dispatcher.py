@@ -0,0 +1,103 @@
+import sys
+import unittest
+from pathlib import Path
+from threading import Event
+from unittest.mock import patch
+
+absolute_plugin_path = str(Path(__file__).parent.parent.parent.absolute())
+
+sys.path.insert(0, absolute_plugin_path)
+
+from de_gensyn_HomeAssistantPlugin import const
+from de_gensyn_HomeAssistantPlugin.backend import callback_dispatcher
+from de_gensyn_HomeAssistantPlugin.backend.callback_dispatcher import CallbackDispatcher
+
+
+def _update(*changed_fields):
+    return {const.STATE: changed_fields[-1], const.CHANGED_FIELDS: frozenset(changed_fields)}
+
+
+class TestCallbackDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = CallbackDispatcher("TestCallbacks")
+        self.calls = []
+        self.release = Event()
+        self._block_worker()
+
+    def _block_worker(self):
+        """Keep the worker busy, so callbacks submitted afterwards stay queued until released."""
+        blocked = Event()
+        self.release.clear()
+        self.dispatcher.submit(lambda: blocked.set() or self.release.wait())
+        self.assertTrue(blocked.wait(1))
+
+    def _wait_for_queue(self):
+        """Release the worker and wait until all callbacks queued so far have been executed."""
+        done = Event()
+        self.dispatcher.submit(done.set)
+        self.release.set()
+        self.assertTrue(done.wait(1))
+
+    def test_update_replaces_queued_update(self):
+        self.dispatcher.submit_update("key", lambda state: self.calls.append(("old", state)),
+                                      _update("state"))
+        self.dispatcher.submit_update("key", lambda state: self.calls.append(("new", state)),
+                                      _update("brightness"))
+
+        self.assertEqual(1, self.dispatcher.get_coalesced_count())
+        self._wait_for_queue()
+
+        self.assertEqual(1, len(self.calls))
+        name, state = self.calls[0]
+        self.assertEqual("new", name)
+        self.assertEqual("brightness", state[const.STATE])
+        self.assertEqual({"state", "brightness"}, state[const.CHANGED_FIELDS])
+
+    def test_updates_of_other_keys_are_kept(self):
+        self.dispatcher.submit_update("first", lambda state: self.calls.append("first"),
+                                      _update("state"))
+        self.dispatcher.submit_update("second", lambda state: self.calls.append("second"),
+                                      _update("state"))
+        self._wait_for_queue()
+
+        self.assertEqual(["first", "second"], self.calls)
+        self.assertEqual(0, self.dispatcher.get_coalesced_count())
+
+    def test_update_after_execution_is_queued_again(self):
+        self.dispatcher.submit_update("key", self.calls.append, _update("state"))
+        self._wait_for_queue()
+        self._block_worker()
+        self.dispatcher.submit_update("key", self.calls.append, _update("brightness"))
+        self._wait_for_queue()
+
+        self.assertEqual([{"state"}, {"brightness"}],
+                         [state[const.CHANGED_FIELDS] for state in self.calls])
+
+    def test_callbacks_are_never_dropped_or_reordered(self):
+        for i in range(1000):
+            self.dispatcher.submit(self.calls.append, i)
+            self.dispatcher.submit_update("key", lambda state: None, _update("state"))
+
+        self.assertEqual(1001, self.dispatcher.get_depth())
+        self._wait_for_queue()
+
+        self.assertEqual(list(range(1000)), self.calls)
+        self.assertEqual(0, self.dispatcher.get_depth())
+        self.assertEqual(1002, self.dispatcher.get_max_depth())
+
+    def test_exception_does_not_stop_worker(self):
+        def fail():
+            raise ValueError("broken action")
+
+        with patch.object(callback_dispatcher, "log") as log:
+            self.dispatcher.submit(fail)
+            self.dispatcher.submit(self.calls.append, "after")
+            self._wait_for_queue()
+
+        self.assertEqual(["after"], self.calls)
+        log.exception.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
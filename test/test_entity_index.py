@@ -0,0 +1,103 @@
+import sys
+import unittest
+from pathlib import Path
+
+absolute_plugin_path = str(Path(__file__).parent.parent.parent.absolute())
+
+sys.path.insert(0, absolute_plugin_path)
+
+from de_gensyn_HomeAssistantPlugin.backend.entity_index import EntityIndex
+from de_gensyn_HomeAssistantPlugin.backend.entity_store import EntityRecord
+
+
+class TestEntityIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = EntityIndex()
+        self.index.rebuild({
+            "switch": {"switch.b": None, "switch.a": None},
+            "light": {"light.kitchen": None},
+        })
+
+    def test_rebuild(self):
+        self.assertEqual(["light", "switch"], self.index.get_domains())
+        self.assertEqual(["switch.a", "switch.b"], self.index.get_entities("switch"))
+        self.assertEqual([], self.index.get_entities("sensor"))
+
+        self.index.rebuild({"sensor": {"sensor.x": None}})
+
+        self.assertEqual(["sensor"], self.index.get_domains())
+        self.assertEqual([], self.index.get_entities("switch"))
+
+    def test_add(self):
+        self.index.add("switch.aa")
+        self.index.add("cover.garage")
+
+        self.assertEqual(["cover", "light", "switch"], self.index.get_domains())
+        self.assertEqual(["switch.a", "switch.aa", "switch.b"], self.index.get_entities("switch"))
+        self.assertEqual(["cover.garage"], self.index.get_entities("cover"))
+
+    def test_add_existing(self):
+        self.index.add("switch.a")
+
+        self.assertEqual(["switch.a", "switch.b"], self.index.get_entities("switch"))
+
+    def test_remove(self):
+        self.index.remove("switch.a")
+
+        self.assertEqual(["light", "switch"], self.index.get_domains())
+        self.assertEqual(["switch.b"], self.index.get_entities("switch"))
+
+    def test_remove_last_entity_of_domain(self):
+        self.index.remove("light.kitchen")
+
+        self.assertEqual(["switch"], self.index.get_domains())
+        self.assertEqual([], self.index.get_entities("light"))
+
+    def test_remove_unknown(self):
+        self.index.remove("switch.unknown")
+        self.index.remove("sensor.unknown")
+
+        self.assertEqual(["light", "switch"], self.index.get_domains())
+        self.assertEqual(["switch.a", "switch.b"], self.index.get_entities("switch"))
+
+    def test_results_are_copies(self):
+        self.index.get_domains().clear()
+        self.index.get_entities("switch").clear()
+
+        self.assertEqual(["light", "switch"], self.index.get_domains())
+        self.assertEqual(["switch.a", "switch.b"], self.index.get_entities("switch"))
+
+    def test_search_prefix_before_fuzzy(self):
+        self.index.rebuild({"light": {
+            "light.desk": EntityRecord("on", {"friendly_name": "Desk Lamp"}, 1),
+            "light.kitchen": EntityRecord("on", {"friendly_name": "Kitchen Ceiling"}, 1),
+            "light.bedroom_lamp": EntityRecord("on", {}, 1),
+        }})
+
+        # object id prefix, friendly name word prefix, then fuzzy match on the object id
+        self.assertEqual(["light.desk"], self.index.search("desk"))
+        self.assertEqual(["light.kitchen"], self.index.search("ceil"))
+        self.assertEqual(["light.desk", "light.bedroom_lamp"], self.index.search("lamp"))
+        self.assertEqual(["light.kitchen"], self.index.search("ktchn"))
+        self.assertEqual(["light.bedroom_lamp", "light.desk"], self.index.search("Light.", limit=2))
+
+    def test_search_domain(self):
+        self.assertEqual(["switch.a", "switch.b"], self.index.search("", "switch"))
+        self.assertEqual([], self.index.search("kitchen", "switch"))
+        self.assertEqual(["light.kitchen"], self.index.search("kitchen"))
+
+    def test_search_follows_changes(self):
+        self.index.add("sensor.power", EntityRecord("1", {"friendly_name": "Grid"}, 1))
+        self.assertEqual(["sensor.power"], self.index.search("grid"))
+
+        self.index.update_name("sensor.power", EntityRecord("1", {"friendly_name": "Solar"}, 2))
+        self.assertEqual([], self.index.search("grid"))
+        self.assertEqual(["sensor.power"], self.index.search("solar"))
+
+        self.index.remove("sensor.power")
+        self.assertEqual([], self.index.search("solar"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+from queue import Queue
+
+absolute_plugin_path = str(Path(__file__).parent.parent.parent.absolute())
+
+sys.path.insert(0, absolute_plugin_path)
+
+from de_gensyn_HomeAssistantPlugin import const
+from de_gensyn_HomeAssistantPlugin.backend.envelope import Envelope
+from de_gensyn_HomeAssistantPlugin.backend.home_assistant import HomeAssistantBackend, KEPT_ATTRIBUTES
+
+
+class TestHandleEntitiesEvent(unittest.TestCase):
+
+    def setUp(self):
+        self.updates = Queue()
+        self.backend = HomeAssistantBackend()
+        self._run(self._set_up_entity)
+
+    def tearDown(self):
+        self.backend._loop.call_soon_threadsafe(self.backend._loop.stop)
+
+    def _run(self, function, *args):
+        """Run a function on the event loop of the backend, like all its handlers are."""
+        async def run():
+            return function(*args)
+
+        return asyncio.run_coroutine_threadsafe(run(), self.backend._loop).result(1)
+
+    def _set_up_entity(self):
+        self.backend._store.publish("light.x", "on", {"brightness": 1})
+        self.backend._index.rebuild(self.backend._store.get_all())
+        self.backend._projections["light.x"] = KEPT_ATTRIBUTES | {"brightness"}
+        self.backend._registry.add("light.x", "key", lambda state=None: self.updates.put(state))
+
+    def _handle(self, event):
+        self._run(self.backend._handle_entities_event, Envelope({"event": event}))
+
+    def test_remove(self):
+        self._handle({"r": ["light.x"]})
+
+        self.assertEqual("N/A", self.backend.get_entity("light.x")[const.STATE])
+        self.assertEqual([], self._run(self.backend._index.get_entities, "light"))
+        # the key is redrawn without a state
+        self.assertIsNone(self.updates.get(timeout=1))
+
+    def test_remove_and_add_again(self):
+        self._handle({"r": ["light.x"]})
+        self._handle({"a": {"light.x": {"s": "off", "a": {"brightness": 2, "color": "red"}}}})
+
+        entity = self.backend.get_entity("light.x")
+        self.assertEqual("off", entity[const.STATE])
+        self.assertEqual({"brightness": 2}, entity[const.ATTRIBUTES])
+        self.assertGreater(entity[const.VERSION], 0)
+        self.assertEqual(["light.x"], self._run(self.backend._index.get_entities, "light"))
+
+        self.assertIsNone(self.updates.get(timeout=1))
+        update = self.updates.get(timeout=1)
+        self.assertEqual("off", update[const.STATE])
+        self.assertEqual({const.STATE, "brightness"}, update[const.CHANGED_FIELDS])
+
+    def test_changes_after_adding_again(self):
+        self._handle({"r": ["light.x"]})
+        self._handle({"a": {"light.x": {"s": "off", "a": {"brightness": 2}}}})
+        self._handle({"c": {"light.x": {"+": {"s": "on"}}}})
+
+        self.assertEqual("on", self.backend.get_entity("light.x")[const.STATE])
+
+    def test_search_follows_friendly_name(self):
+        self._handle({"c": {"light.x": {"+": {"a": {"friendly_name": "Desk Lamp"}}}}})
+
+        self.assertEqual(["light.x"], self._run(self.backend._index.search, "desk"))
+
+        self._handle({"r": ["light.x"]})
+        self._handle({"a": {"light.x": {"s": "on", "a": {"friendly_name": "Ceiling"}}}})
+
+        self.assertEqual([], self._run(self.backend._index.search, "desk"))
+        self.assertEqual(["light.x"], self._run(self.backend._index.search, "ceil"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import sys
+import unittest
+from pathlib import Path
+
+absolute_plugin_path = str(Path(__file__).parent.parent.parent.absolute())
+
+sys.path.insert(0, absolute_plugin_path)
+
+from de_gensyn_HomeAssistantPlugin.backend import state_delta
+from de_gensyn_HomeAssistantPlugin.backend.entity_store import EntityRecord, ValuePool
+
+
+class TestStateDelta(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ValuePool()
+        self.attributes = {"friendly_name": "Lamp", "brightness": 100}
+        self.entity = EntityRecord("on", self.attributes, 1)
+
+    def test_apply_compressed_state(self):
+        state, attributes, changed = state_delta.apply_compressed_state(
+            self.entity, {"s": "off", "a": {"friendly_name": "Lamp", "brightness": 50}}, self.pool
+        )
+
+        self.assertEqual("off", state)
+        self.assertEqual({"friendly_name": "Lamp", "brightness": 50}, attributes)
+        self.assertEqual({"state", "brightness"}, changed)
+
+    def test_apply_compressed_state_removes_missing_attributes(self):
+        _, attributes, changed = state_delta.apply_compressed_state(
+            self.entity, {"s": "on", "a": {"friendly_name": "Lamp"}}, self.pool
+        )
+
+        self.assertEqual({"friendly_name": "Lamp"}, attributes)
+        self.assertEqual({"brightness"}, changed)
+
+    def test_apply_compressed_state_unchanged(self):
+        state, attributes, changed = state_delta.apply_compressed_state(
+            self.entity, {"s": "on", "a": dict(self.attributes)}, self.pool
+        )
+
+        self.assertEqual("on", state)
+        # nothing changed, so the published attributes are reused
+        self.assertIs(self.attributes, attributes)
+        self.assertEqual(set(), changed)
+
+    def test_apply_diff(self):
+        state, attributes, changed = state_delta.apply_diff(
+            self.entity, {"+": {"a": {"brightness": 20, "color": "red"}}}, self.pool
+        )
+
+        self.assertEqual("on", state)
+        self.assertEqual({"friendly_name": "Lamp", "brightness": 20, "color": "red"}, attributes)
+        self.assertEqual({"brightness", "color"}, changed)
+
+    def test_apply_diff_state_and_removals(self):
+        state, attributes, changed = state_delta.apply_diff(
+            self.entity, {"+": {"s": "off"}, "-": {"a": ["brightness", "unknown"]}}, self.pool
+        )
+
+        self.assertEqual("off", state)
+        self.assertEqual({"friendly_name": "Lamp"}, attributes)
+        self.assertEqual({"state", "brightness"}, changed)
+
+    def test_apply_diff_does_not_change_record(self):
+        state_delta.apply_diff(
+            self.entity, {"+": {"s": "off", "a": {"brightness": 1}}, "-": {"a": ["friendly_name"]}},
+            self.pool
+        )
+
+        self.assertEqual("on", self.entity.state)
+        self.assertIs(self.attributes, self.entity.attributes)
+        self.assertEqual({"friendly_name": "Lamp", "brightness": 100}, self.attributes)
+
+    def test_apply_diff_with_projection(self):
+        _, attributes, changed = state_delta.apply_diff(
+            self.entity, {"+": {"a": {"brightness": 20, "color": "red"}}}, self.pool,
+            frozenset({"friendly_name", "brightness"})
+        )
+
+        self.assertEqual({"friendly_name": "Lamp", "brightness": 20}, attributes)
+        self.assertEqual({"brightness"}, changed)
+
+    def test_apply_compressed_state_with_projection(self):
+        _, attributes, changed = state_delta.apply_compressed_state(
+            self.entity, {"s": "on", "a": {"friendly_name": "Lamp", "brightness": 100, "x": 1}},
+            self.pool, frozenset({"friendly_name"})
+        )
+
+        self.assertEqual({"friendly_name": "Lamp"}, attributes)
+        self.assertEqual({"brightness"}, changed)
+
+    def test_get_changed_fields(self):
+        changed = state_delta.get_changed_fields(
+            self.entity, "off", {"friendly_name": "Lamp", "color": "red"}
+        )
+
+        self.assertEqual({"state", "brightness", "color"}, changed)
+        self.assertEqual(set(), state_delta.get_changed_fields(self.entity, "on", self.attributes))
+
+    def test_project(self):
+        self.assertIs(self.attributes, state_delta.project(self.attributes, None))
+        self.assertEqual({"brightness": 100},
+                         state_delta.project(self.attributes, frozenset({"brightness", "x"})))
+
+    def test_values_are_shared(self):
+        first = state_delta.apply_diff(self.entity, {"+": {"a": {"modes": ["a", "b"]}}}, self.pool)
+        second = state_delta.apply_diff(self.entity, {"+": {"a": {"modes": ["a", "b"]}}}, self.pool)
+
+        self.assertIs(first[1]["modes"], second[1]["modes"])
+
+
+if __name__ == '__main__':
+    unittest.main()
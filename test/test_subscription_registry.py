@@ -0,0 +1,123 @@
+import gc
+import sys
+import unittest
+from pathlib import Path
+
+absolute_plugin_path = str(Path(__file__).parent.parent.parent.absolute())
+
+sys.path.insert(0, absolute_plugin_path)
+
+from de_gensyn_HomeAssistantPlugin.backend.subscription_registry import SubscriptionRegistry
+
+
+class Action:
+
+    def on_update(self, state):
+        pass
+
+
+class TestSubscriptionRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.collected = []
+        self.registry = SubscriptionRegistry(
+            lambda entity_id, uid, ref: self.collected.append((entity_id, uid, ref))
+        )
+
+    def test_add_and_remove(self):
+        self.assertTrue(self.registry.add("light.a", "key1", print))
+        self.assertFalse(self.registry.add("light.a", "key2", print))
+
+        self.assertEqual(2, self.registry.get_ref_count("light.a"))
+        self.assertTrue(self.registry.contains("light.a", "key1"))
+        self.assertEqual("light.a", self.registry.get_entity_id("key1"))
+        self.assertEqual({"light.a"}, self.registry.get_entity_ids())
+
+        self.assertFalse(self.registry.remove("light.a", "key1"))
+        self.assertTrue(self.registry.remove("light.a", "key2"))
+
+        self.assertEqual(0, self.registry.get_ref_count("light.a"))
+        self.assertEqual(set(), self.registry.get_entity_ids())
+        self.assertIsNone(self.registry.get_entity_id("key1"))
+        self.assertEqual({"entities": 0, "keys": 0}, self.registry.get_stats())
+
+    def test_remove_unknown(self):
+        self.registry.add("light.a", "key1", print)
+
+        self.assertFalse(self.registry.remove("light.a", "key2"))
+        self.assertFalse(self.registry.remove("light.b", "key1"))
+        self.assertEqual(1, self.registry.get_ref_count("light.a"))
+
+    def test_add_moves_key(self):
+        self.registry.add("light.a", "key1", print)
+        self.registry.add("light.a", "key2", print)
+
+        self.assertTrue(self.registry.add("light.b", "key1", print))
+
+        self.assertFalse(self.registry.contains("light.a", "key1"))
+        self.assertTrue(self.registry.contains("light.b", "key1"))
+        self.assertEqual("light.b", self.registry.get_entity_id("key1"))
+        self.assertEqual({"light.a": ["key2"], "light.b": ["key1"]},
+                         self.registry.get_subscriptions())
+        self.assertEqual({"entities": 2, "keys": 2}, self.registry.get_stats())
+
+    def test_add_moves_last_key(self):
+        self.registry.add("light.a", "key1", print)
+        self.registry.add("light.b", "key1", print)
+
+        self.assertEqual({"light.b"}, self.registry.get_entity_ids())
+
+    def test_callbacks(self):
+        action = Action()
+        self.registry.add("light.a", "key1", action.on_update)
+        self.registry.add("light.a", "key2", print)
+
+        self.assertEqual([("key1", action.on_update), ("key2", print)],
+                         self.registry.get_callbacks("light.a"))
+        self.assertEqual([action.on_update, print], self.registry.get_all_callbacks())
+        self.assertEqual([], self.registry.get_callbacks("light.b"))
+
+    def test_bound_methods_are_weak(self):
+        action = Action()
+        self.registry.add("light.a", "key1", action.on_update)
+
+        del action
+        gc.collect()
+
+        self.assertEqual(1, len(self.collected))
+        entity_id, uid, ref = self.collected[0]
+        self.assertEqual(("light.a", "key1"), (entity_id, uid))
+        self.assertTrue(self.registry.is_current(entity_id, uid, ref))
+        self.assertEqual([], self.registry.get_callbacks("light.a"))
+
+    def test_plain_functions_are_kept(self):
+        self.registry.add("light.a", "key1", lambda state: None)
+        gc.collect()
+
+        self.assertEqual([], self.collected)
+        self.assertEqual(1, len(self.registry.get_callbacks("light.a")))
+
+    def test_is_current(self):
+        action = Action()
+        self.registry.add("light.a", "key1", action.on_update)
+
+        del action
+        gc.collect()
+        ref = self.collected[0][2]
+
+        self.assertTrue(self.registry.is_current("light.a", "key1", ref))
+
+        # the key was registered again before the collection was handled
+        action = Action()
+        self.registry.add("light.a", "key1", action.on_update)
+
+        self.assertFalse(self.registry.is_current("light.a", "key1", ref))
+
+        self.registry.remove("light.a", "key1")
+        self.registry.add("light.a", "key1", print)
+
+        self.assertFalse(self.registry.is_current("light.a", "key1", ref))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+absolute_plugin_path = str(Path(__file__).parent.parent.parent.absolute())
+
+sys.path.insert(0, absolute_plugin_path)
+
+from de_gensyn_HomeAssistantPlugin import const
+from de_gensyn_HomeAssistantPlugin.backend.update_coalescer import UpdateCoalescer
+
+
+def _update(*changed_fields):
+    return {const.STATE: changed_fields[-1], const.CHANGED_FIELDS: frozenset(changed_fields)}
+
+
+class TestUpdateCoalescer(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.delivered = []
+        self.coalescer = UpdateCoalescer(self.loop, self._dispatch, 10)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _dispatch(self, uid, callback, update_state):
+        self.delivered.append((uid, callback, update_state, self.loop.time()))
+
+    def _wait(self, seconds):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_first_update_is_delivered_at_once(self):
+        self.coalescer.submit("key", print, _update("state"))
+
+        self.assertEqual(1, len(self.delivered))
+        self.assertEqual(("key", print), self.delivered[0][:2])
+        self.assertEqual(0, self.coalescer.get_pending_count())
+
+    def test_updates_are_rate_limited(self):
+        start = self.loop.time()
+        self.coalescer.submit("key", print, _update("state"))
+        self.coalescer.submit("key", print, _update("brightness"))
+
+        self.assertEqual(1, len(self.delivered))
+        self.assertEqual(1, self.coalescer.get_pending_count())
+
+        self._wait(0.15)
+
+        self.assertEqual(2, len(self.delivered))
+        self.assertGreaterEqual(self.delivered[1][3] - start, 0.1)
+
+    def test_latest_update_wins_and_fields_are_merged(self):
+        self.coalescer.submit("key", print, _update("state"))
+        self.coalescer.submit("key", print, _update("brightness"))
+        self.coalescer.submit("key", repr, _update("color"))
+
+        self._wait(0.15)
+
+        self.assertEqual(2, len(self.delivered))
+        _, callback, update_state, _ = self.delivered[1]
+        self.assertIs(repr, callback)
+        self.assertEqual("color", update_state[const.STATE])
+        self.assertEqual({"brightness", "color"}, update_state[const.CHANGED_FIELDS])
+
+    def test_keys_are_limited_separately(self):
+        self.coalescer.submit("first", print, _update("state"))
+        self.coalescer.submit("second", print, _update("state"))
+
+        self.assertEqual(["first", "second"], [delivered[0] for delivered in self.delivered])
+
+    def test_no_limit(self):
+        self.coalescer.set_max_rate(0)
+        for _ in range(3):
+            self.coalescer.submit("key", print, _update("state"))
+
+        self.assertEqual(3, len(self.delivered))
+
+    def test_discard(self):
+        self.coalescer.submit("key", print, _update("state"))
+        self.coalescer.submit("key", print, _update("brightness"))
+        self.coalescer.discard("key")
+
+        self._wait(0.15)
+
+        self.assertEqual(1, len(self.delivered))
+        self.assertEqual(0, self.coalescer.get_pending_count())
+
+    def test_flush(self):
+        self.coalescer.submit("key", print, _update("state"))
+        self.coalescer.submit("key", print, _update("brightness"))
+        self.coalescer.flush()
+
+        self.assertEqual(2, len(self.delivered))
+        self.assertEqual(0, self.coalescer.get_pending_count())
+
+        # the cancelled timer must not deliver anything
+        self._wait(0.15)
+        self.assertEqual(2, len(self.delivered))
+
+
+if __name__ == '__main__':
+    unittest.main()